@@ -1,9 +1,64 @@
 from django.contrib import admin
+from django.db.models import Q
+from django.utils.text import smart_split, unescape_string_literal
+
+from .models import Building, Room, Resident, WebhookSubscriber
+from .pagination import EstimatedCountPaginator
+
+
+@admin.register(Building)
+class BuildingAdmin(admin.ModelAdmin):
+    list_display = ["name", "address"]
+    search_fields = ["^name"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Room)
+class RoomAdmin(admin.ModelAdmin):
+    list_display = ["room_number", "building", "capacity"]
+    list_select_related = ["building"]
+    autocomplete_fields = ["building"]
+    search_fields = ["^room_number", "^building__name"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # Room.__str__ includes the building name, e.g. in resident autocompletes.
+        return super().get_queryset(request).select_related("building")
+
+    def get_search_results(self, request, queryset, search_term):
+        # Buildings are matched in a subquery: an OR across the join would
+        # stop SQLite from using the NOCASE indexes and scan every room.
+        for bit in smart_split(search_term):
+            if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+                bit = unescape_string_literal(bit)
+            buildings = Building.objects.filter(name__istartswith=bit).values("pk")
+            queryset = queryset.filter(
+                Q(room_number__istartswith=bit) | Q(building__in=buildings)
+            )
+        return queryset, False
+
+
+@admin.register(Resident)
+class ResidentAdmin(admin.ModelAdmin):
+    list_display = [
+        "last_name",
+        "first_name",
+        "email",
+        "room",
+        "check_in_date",
+        "check_out_date",
+    ]
+    list_select_related = ["room__building"]
+    autocomplete_fields = ["room"]
+    search_fields = ["^last_name", "^first_name", "=email"]
+    date_hierarchy = "check_in_date"
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
-# Register your models here.
-from django.contrib import admin
-from .models import Building, Room, Resident
 
-admin.site.register(Building)
-admin.site.register(Room)
-admin.site.register(Resident)
+@admin.register(WebhookSubscriber)
+class WebhookSubscriberAdmin(admin.ModelAdmin):
+    list_display = ["name", "url", "active", "cursor", "failures", "next_attempt_at"]
+    readonly_fields = ["failures", "next_attempt_at", "last_error"]
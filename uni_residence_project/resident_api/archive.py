@@ -0,0 +1,88 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+
+from .models import ChangeLogEntry, Resident, ResidentArchive, ShardMap
+
+
+def archive_cutoff(older_than_days=None):
+    if older_than_days is None:
+        older_than_days = getattr(settings, "RESIDENT_ARCHIVE_AFTER_DAYS", 365)
+    return timezone.localdate() - timedelta(days=older_than_days)
+
+
+def archive_batch(cutoff, batch_size=1000):
+    """
+    Move up to ``batch_size`` residents who checked out before ``cutoff`` into
+    ResidentArchive, in one transaction. Returns the number moved; call until
+    it returns 0. A crash loses at most the open batch, which is rolled back,
+    so the job can simply be restarted.
+    """
+    db = router.db_for_write(Resident)
+    with transaction.atomic(using=db):
+        rows = list(
+            Resident.objects.using(db)
+            .filter(check_out_date__lt=cutoff)
+            .order_by("id")
+            .values(*ResidentArchive.copied_fields)[:batch_size]
+        )
+        if not rows:
+            return 0
+        ids = [row["id"] for row in rows]
+        ResidentArchive.objects.using(db).bulk_create(
+            [ResidentArchive(**row) for row in rows], ignore_conflicts=True
+        )
+        # Nothing references Resident, so skip the collector and its
+        # per-object signals; the change feed is told explicitly.
+        Resident.objects.filter(id__in=ids)._raw_delete(db)
+        ChangeLogEntry.record(Resident, ids, ChangeLogEntry.DELETE)
+        if db in ShardMap.shards():
+            # Archived emails may be reused, as on an unsharded database.
+            ShardMap.objects.filter(pk__in=ids).update(email=None)
+    return len(rows)
+
+
+def restore_batch(archived, batch_size=1000):
+    """
+    Move up to ``batch_size`` rows of the ``archived`` queryset back into
+    Resident. Rows whose email is now used by a current resident, or by an
+    earlier row of the batch, are left in the archive. Returns
+    ``(restored, skipped_ids)``.
+    """
+    db = router.db_for_write(Resident)
+    with transaction.atomic(using=db):
+        rows = list(
+            archived.using(db)
+            .order_by("id")
+            .values(*ResidentArchive.copied_fields)[:batch_size]
+        )
+        if not rows:
+            return 0, []
+        emails = [row["email"] for row in rows]
+        if db in ShardMap.shards():
+            taken = ShardMap.emails_in_use(emails)
+        else:
+            taken = set(
+                Resident.objects.using(db)
+                .filter(email__in=emails)
+                .values_list("email", flat=True)
+            )
+        restore = []
+        skipped = []
+        for row in rows:
+            # Archived emails may repeat; only the oldest row gets it back.
+            if row["email"] in taken:
+                skipped.append(row["id"])
+            else:
+                taken.add(row["email"])
+                restore.append(row)
+        # A restored stay is not a new check-in.
+        Resident.objects.using(db).bulk_create(
+            [Resident(**row) for row in restore], publish=False
+        )
+        ResidentArchive.objects.using(db).filter(
+            id__in=[row["id"] for row in restore]
+        ).delete()
+    return len(restore), skipped
@@ -0,0 +1,237 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router, transaction
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.05
+# Every request makes several cache calls; warn about an outage once a minute.
+OUTAGE_WARNING_INTERVAL = 60
+_last_outage_warning = None
+
+
+def _log_outage(e):
+    global _last_outage_warning
+    now = time.monotonic()
+    if (
+        _last_outage_warning is None
+        or now - _last_outage_warning >= OUTAGE_WARNING_INTERVAL
+    ):
+        _last_outage_warning = now
+        logger.warning("Cache unavailable: %s", e)
+    else:
+        logger.debug("Cache unavailable: %s", e)
+
+
+def _cache_call(method, *args, default=None):
+    # A cache outage degrades to uncached responses rather than errors.
+    try:
+        return method(*args)
+    except Exception as e:
+        _log_outage(e)
+        return default
+
+
+def _version_key(model):
+    return f"version:{model._meta.label_lower}"
+
+
+def model_version(model):
+    """
+    Current cache generation of ``model``, bumped by every write. None when
+    the shared cache is unavailable.
+    """
+    key = _version_key(model)
+    version = _cache_call(cache.get, key)
+    if version is None:
+        # Start from the clock so an evicted counter never repeats a value.
+        _cache_call(cache.add, key, time.time_ns(), None)
+        version = _cache_call(cache.get, key)
+    return version
+
+
+def bump_model_version(model):
+    key = _version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        _cache_call(cache.set, key, time.time_ns(), None)
+    except Exception as e:
+        _log_outage(e)
+
+
+def invalidate_model(model, using=None):
+    """
+    Retire cached responses for ``model``. The version is bumped again on
+    commit, so a response recomputed from pre-commit data is not kept.
+    """
+    bump_model_version(model)
+    transaction.on_commit(lambda: bump_model_version(model), using=using)
+
+
+def single_flight(key, compute, timeout, stale_timeout=0):
+    """
+    Return the value cached under ``key``, calling ``compute`` at most once at
+    a time across processes when it is missing or expired.
+
+    The caller that wins a short cache lock computes and stores the value;
+    concurrent callers poll until it appears (or compute it themselves after
+    ``API_CACHE_WAIT_SECONDS``). With ``stale_timeout`` an expired value is
+    kept that much longer and handed out while one caller refreshes it.
+    ``compute`` may return None for a result that must not be cached.
+    """
+    lock_seconds = getattr(settings, "API_CACHE_LOCK_SECONDS", 10)
+    wait_seconds = getattr(settings, "API_CACHE_WAIT_SECONDS", 5)
+    lock = f"{key}:lock"
+    deadline = time.monotonic() + wait_seconds
+    while True:
+        entry = _cache_call(cache.get, key)
+        if entry is not None and entry["fresh_until"] > time.time():
+            return entry["value"]
+        if _cache_call(cache.add, lock, True, lock_seconds, default=True):
+            try:
+                value = compute()
+                if value is not None:
+                    entry = {"value": value, "fresh_until": time.time() + timeout}
+                    _cache_call(cache.set, key, entry, timeout + stale_timeout)
+            finally:
+                _cache_call(cache.delete, lock)
+            return value
+        if entry is not None:
+            # Stale, and another request is already refreshing it.
+            return entry["value"]
+        if time.monotonic() >= deadline:
+            return compute()
+        time.sleep(POLL_INTERVAL)
+
+
+def coalesced_cache(method):
+    """
+    Cache a viewset's GET responses through single_flight. The key is the
+    full path (query string included) and the cache generation of the
+    viewset's model, so any write to that model invalidates it. Only 200
+    responses are cached; permissions are still checked on every request.
+    """
+
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method != "GET":
+            return method(self, request, *args, **kwargs)
+        model = self.queryset.model
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        key = f"api:{self.basename}:{model_version(model)}:{path}"
+
+        response = None
+
+        def compute():
+            nonlocal response
+            response = method(self, request, *args, **kwargs)
+            return response.data if response.status_code == 200 else None
+
+        data = single_flight(
+            key,
+            compute,
+            getattr(settings, "API_CACHE_SECONDS", 60 * 15),
+            getattr(settings, "API_CACHE_STALE_SECONDS", 0),
+        )
+        return response if response is not None else Response(data)
+
+    return wrapper
+
+
+class ReferenceCache:
+    """
+    Per-process read-through cache of a small, rarely written table: rows by
+    primary key, and primary keys by ``natural_key``, each a bounded LRU.
+
+    Everything is dropped as soon as the model's version in the shared cache
+    moves, which every write to it does (see invalidate_model), so other
+    processes' writes are seen on their next lookup. While the shared cache
+    is unavailable lookups go straight to the database.
+    """
+
+    def __init__(self, model, natural_key=(), maxsize=10000):
+        self.model = model
+        self.natural_key = natural_key
+        self.maxsize = maxsize
+        self.attnames = [f.attname for f in model._meta.concrete_fields]
+        self._rows = OrderedDict()
+        self._ids = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _current(self):
+        version = model_version(self.model)
+        with self._lock:
+            if version != self._version:
+                self._rows.clear()
+                self._ids.clear()
+                self._version = version
+        return version is not None
+
+    def _lookup(self, store, key, load):
+        cached = self._current()
+        with self._lock:
+            if cached and key in store:
+                store.move_to_end(key)
+                return store[key]
+        value = load()
+        if cached:
+            with self._lock:
+                store[key] = value
+                if len(store) > self.maxsize:
+                    store.popitem(last=False)
+        return value
+
+    def get(self, pk, using=None):
+        """The row with primary key ``pk`` (a fresh instance), or None."""
+        pk = self.model._meta.pk.to_python(pk)
+        db = using or router.db_for_read(self.model)
+        row = self._lookup(
+            self._rows,
+            (db, pk),
+            lambda: self.model._base_manager.using(db)
+            .filter(pk=pk)
+            .values_list(*self.attnames)
+            .first(),
+        )
+        return None if row is None else self.model.from_db(db, self.attnames, row)
+
+    def get_id(self, using=None, **natural_key):
+        """Primary key of the row with this natural key, or None."""
+        db = using or router.db_for_read(self.model)
+        key = (db, tuple(natural_key[name] for name in self.natural_key))
+        return self._lookup(
+            self._ids,
+            key,
+            lambda: self.model._base_manager.using(db)
+            .filter(**natural_key)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+            .first(),
+        )
+
+
+_reference_caches = {}
+
+REFERENCE_NATURAL_KEYS = {"resident_api.room": ("building_id", "room_number")}
+
+
+def reference_cache(model):
+    """The process-wide ReferenceCache for ``model``."""
+    label = model._meta.label_lower
+    if label not in _reference_caches:
+        _reference_caches[label] = ReferenceCache(
+            model,
+            REFERENCE_NATURAL_KEYS.get(label, ()),
+            getattr(settings, "REFERENCE_CACHE_SIZE", 10000),
+        )
+    return _reference_caches[label]
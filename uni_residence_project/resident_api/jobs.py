@@ -0,0 +1,254 @@
+import csv
+import heapq
+import io
+import json
+import logging
+import tempfile
+import traceback
+from collections import defaultdict
+from datetime import timedelta
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile, File
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .caching import reference_cache
+from .models import Building, Job, Resident, Room
+from .routers import shards
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2000
+RESIDENT_COLUMNS = [
+    "id",
+    "first_name",
+    "last_name",
+    "email",
+    "room_id",
+    "check_in_date",
+    "check_out_date",
+]
+
+
+def export_residents(job, report_progress):
+    sources = [Resident.objects.using(alias).order_by("id") for alias in shards()]
+    total = sum(residents.count() for residents in sources) or 1
+    # Spooled to disk rather than memory: a full export can be large.
+    output = io.TextIOWrapper(tempfile.TemporaryFile(), encoding="utf-8", newline="")
+    writer = csv.writer(output)
+    writer.writerow(RESIDENT_COLUMNS)
+    # Rows start with the id, so merging keeps the file ordered across shards.
+    rows = heapq.merge(
+        *(
+            residents.values_list(*RESIDENT_COLUMNS).iterator(chunk_size=CHUNK_SIZE)
+            for residents in sources
+        )
+    )
+    for n, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if n % CHUNK_SIZE == 0:
+            report_progress(n * 100 // total)
+    output.flush()
+    return "residents.csv", File(output.detach()), "text/csv"
+
+
+def room_by_number(building_id, room_number):
+    """The id of the room numbered ``room_number`` in a building, or None."""
+    if not building_id.isdigit():
+        return None
+    rooms = reference_cache(Room)
+    for alias in shards():
+        room_id = rooms.get_id(
+            using=alias, building_id=int(building_id), room_number=room_number
+        )
+        if room_id is not None:
+            return room_id
+    return None
+
+
+def import_residents(job, report_progress):
+    """
+    Create residents from an uploaded CSV with first_name, last_name, email,
+    room_id (or building_id and room_number), check_in_date and (optional)
+    check_out_date columns. Rows are validated and inserted in chunks; invalid
+    rows are reported, not fatal.
+    """
+    with job.input_file.open("rb") as input_file:
+        rows = list(csv.DictReader(io.TextIOWrapper(input_file, encoding="utf-8")))
+    # Residents are created on their room's shard.
+    room_shards = {
+        room_id: alias
+        for alias in shards()
+        for room_id in Room.objects.using(alias).values_list("id", flat=True)
+    }
+    created = 0
+    errors = []
+
+    for start in range(0, len(rows), CHUNK_SIZE):
+        chunk = rows[start : start + CHUNK_SIZE]
+        emails = {row.get("email", "") for row in chunk}
+        taken = {
+            email
+            for alias in shards()
+            for email in Resident.objects.using(alias)
+            .filter(email__in=emails)
+            .values_list("email", flat=True)
+        }
+        residents = defaultdict(list)
+        for line, row in enumerate(chunk, start + 2):
+            room_id = row.get("room_id") or None
+            resident = Resident(
+                first_name=row.get("first_name", ""),
+                last_name=row.get("last_name", ""),
+                email=row.get("email", ""),
+                room_id=int(room_id) if room_id and room_id.isdigit() else room_id,
+                check_in_date=row.get("check_in_date") or None,
+                check_out_date=row.get("check_out_date") or None,
+            )
+            try:
+                resident.full_clean(exclude=["room"], validate_unique=False)
+                if resident.room_id is None and row.get("room_number"):
+                    resident.room_id = room_by_number(
+                        row.get("building_id") or "", row["room_number"]
+                    )
+                    if resident.room_id is None:
+                        raise ValidationError({"room_number": ["Unknown room."]})
+                if resident.room_id is not None and resident.room_id not in room_shards:
+                    raise ValidationError({"room_id": ["Unknown room."]})
+                if resident.email in taken:
+                    raise ValidationError({"email": ["Already exists."]})
+            except ValidationError as e:
+                errors.append({"line": line, "errors": e.message_dict})
+                continue
+            taken.add(resident.email)
+            residents[room_shards.get(resident.room_id)].append(resident)
+
+        for alias, objs in residents.items():
+            # Also publishes a checked_in event per resident, in one transaction.
+            Resident.objects.using(alias).bulk_create(objs)
+            created += len(objs)
+        report_progress(min(start + CHUNK_SIZE, len(rows)) * 100 // (len(rows) or 1))
+
+    summary = {"created": created, "errors": errors}
+    content = ContentFile(json.dumps(summary).encode())
+    return "import-summary.json", content, "application/json"
+
+
+def occupancy_report(job, report_progress):
+    today = timezone.now().date()
+    current = Q(room__resident__check_in_date__lte=today) & (
+        Q(room__resident__check_out_date__isnull=True)
+        | Q(room__resident__check_out_date__gte=today)
+    )
+    buildings = []
+    capacities = {}
+    for alias in shards():
+        buildings += (
+            Building.objects.using(alias)
+            .annotate(occupants=Count("room__resident", filter=current))
+            .values("id", "name", "occupants")
+        )
+        capacities.update(
+            Building.objects.using(alias)
+            .annotate(capacity=Sum("room__capacity"))
+            .values_list("id", "capacity")
+        )
+    buildings.sort(key=itemgetter("id"))
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["building_id", "building", "occupants", "capacity", "rate"])
+    for building in buildings:
+        capacity = capacities.get(building["id"]) or 0
+        rate = building["occupants"] / capacity if capacity else 0
+        writer.writerow(
+            [
+                building["id"],
+                building["name"],
+                building["occupants"],
+                capacity,
+                f"{rate:.4f}",
+            ]
+        )
+    return "occupancy.csv", ContentFile(output.getvalue().encode()), "text/csv"
+
+
+# Each returns (filename, File, content_type); run_job stores and closes it.
+JOB_HANDLERS = {
+    "export_residents": export_residents,
+    "import_residents": import_residents,
+    "occupancy_report": occupancy_report,
+}
+
+
+def claim_jobs(limit):
+    """
+    Move up to ``limit`` queued jobs to running. The conditional UPDATE makes
+    claiming safe when several workers poll the same table.
+    """
+    claimed = []
+    if limit <= 0:
+        return claimed
+    candidates = Job.objects.filter(status=Job.QUEUED).order_by("id")
+    for pk in candidates.values_list("id", flat=True)[: limit * 2]:
+        now = timezone.now()
+        updated = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, started_at=now, heartbeat_at=now
+        )
+        if updated:
+            claimed.append(pk)
+        if len(claimed) == limit:
+            break
+    return claimed
+
+
+def renew_leases(job_ids):
+    Job.objects.filter(pk__in=job_ids, status=Job.RUNNING).update(
+        heartbeat_at=timezone.now()
+    )
+
+
+def requeue_abandoned_jobs():
+    """
+    Put running jobs whose lease ran out back in the queue: the run_jobs
+    process that claimed them stopped renewing it, e.g. it was killed.
+    """
+    lease = timedelta(seconds=getattr(settings, "JOB_LEASE_SECONDS", 60))
+    requeued = Job.objects.filter(
+        status=Job.RUNNING, heartbeat_at__lt=timezone.now() - lease
+    ).update(status=Job.QUEUED, progress=0, started_at=None, heartbeat_at=None)
+    if requeued:
+        logger.warning("Requeued %d abandoned job(s)", requeued)
+    return requeued
+
+
+def run_job(job_id):
+    """Execute a claimed job. Runs inside a worker process."""
+    job = Job.objects.get(pk=job_id)
+
+    def report_progress(percent):
+        Job.objects.filter(pk=job_id).update(progress=min(int(percent), 99))
+
+    try:
+        handler = JOB_HANDLERS[job.kind]
+        filename, content, content_type = handler(job, report_progress)
+    except Exception:
+        logger.exception("Job %s (%s) failed", job_id, job.kind)
+        Job.objects.filter(pk=job_id).update(
+            status=Job.FAILED, error=traceback.format_exc(), finished_at=timezone.now()
+        )
+        return Job.FAILED
+
+    with content:
+        job.result.save(f"{job_id}-{filename}", content, save=False)
+    Job.objects.filter(pk=job_id).update(
+        status=Job.SUCCEEDED,
+        progress=100,
+        result=job.result.name,
+        result_content_type=content_type,
+        finished_at=timezone.now(),
+    )
+    return Job.SUCCEEDED
@@ -0,0 +1,139 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+
+
+class JsonFormatter(logging.Formatter):
+    """Render a record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "process": record.process,
+            "thread": record.thread,
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        for key in ("status_code", "duration", "sql", "alias"):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Thin out high-volume loggers before a record is queued.
+
+    ``rate`` keeps that fraction of records, ``per_second`` caps how many are
+    let through each second. Records at ``always_level`` or above always pass.
+    """
+
+    def __init__(self, rate=1.0, per_second=None, always_level="WARNING"):
+        super().__init__()
+        self.rate = rate
+        self.per_second = per_second
+        self.always_level = logging._checkLevel(always_level)
+        self._window = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.always_level:
+            return True
+        if self.rate < 1.0 and random.random() >= self.rate:
+            return False
+        if self.per_second is None:
+            return True
+        with self._lock:
+            window = int(time.monotonic())
+            if window != self._window:
+                self._window = window
+                self._count = 0
+            self._count += 1
+            return self._count <= self.per_second
+
+
+class BackgroundRotatingFileHandler(logging.handlers.QueueHandler):
+    """
+    Size-rotated file sink written from a background thread.
+
+    The calling thread only puts the record on a bounded in-memory queue; a
+    ``QueueListener`` formats and writes it. When the queue is full the record
+    is dropped and counted rather than blocking the request.
+    """
+
+    def __init__(
+        self, filename, maxBytes=10 * 1024 * 1024, backupCount=5, queue_size=10000
+    ):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.queue_size = queue_size
+        self.target = logging.handlers.RotatingFileHandler(
+            filename, maxBytes=maxBytes, backupCount=backupCount, delay=True
+        )
+        self.dropped = 0
+        self.listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread, in the file sink.
+        self.target.setFormatter(fmt)
+
+    def setLevel(self, level):
+        super().setLevel(level)
+        self.target.setLevel(level)
+
+    def _ensure_listener(self):
+        # Started lazily so each worker process forked after settings load gets
+        # its own listener thread.
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                if self._pid is not None:
+                    # Forked from a process that was already logging.
+                    self.queue = queue.Queue(maxsize=self.queue_size)
+                self.listener = logging.handlers.QueueListener(
+                    self.queue, self.target, respect_handler_level=True
+                )
+                self.listener.start()
+                self._pid = os.getpid()
+
+    def prepare(self, record):
+        # The record stays in this process, so skip QueueHandler's eager
+        # formatting and let the listener do it.
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        if self.listener is not None and self._pid == os.getpid():
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        self.stop()
+        super().close()
+
+    def stop(self):
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            self._pid = None
+        self.target.close()
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from resident_api.archive import archive_batch, archive_cutoff
+from resident_api.routers import on_shard, shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Move residents who checked out more than --older-than-days ago "
+        "(default: settings.RESIDENT_ARCHIVE_AFTER_DAYS) into ResidentArchive, "
+        "one transaction per batch. Safe to interrupt and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-days", type=int)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options["older_than_days"])
+        total = 0
+        for alias in shards():
+            with on_shard(alias):
+                while moved := archive_batch(cutoff, options["batch_size"]):
+                    total += moved
+                    self.stdout.write(f"Archived {total} residents...")
+        self.stdout.write(f"Archived {total} residents checked out before {cutoff}.")
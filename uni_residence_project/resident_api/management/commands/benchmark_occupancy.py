@@ -0,0 +1,81 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from resident_api.reports import daily_occupancy
+
+
+def naive_occupancy(building_index, start_offsets, end_offsets, n_buildings, days):
+    occupancy = [[0] * days for _ in range(n_buildings)]
+    for b, start, end in zip(building_index, start_offsets, end_offsets):
+        row = occupancy[b]
+        for day in range(start, end):
+            row[day] += 1
+    return occupancy
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the vectorised occupancy kernel on synthetic resident stays "
+        "against a plain Python loop over days x residents."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stays", type=int, default=500_000)
+        parser.add_argument("--buildings", type=int, default=50)
+        parser.add_argument("--days", type=int, default=180)
+        parser.add_argument(
+            "--naive-sample",
+            type=int,
+            default=20_000,
+            help="Stays timed with the Python loop; extrapolated to --stays.",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        stays, days = options["stays"], options["days"]
+        building_index = rng.integers(0, options["buildings"], stays)
+        start_offsets = rng.integers(0, days, stays)
+        end_offsets = np.minimum(start_offsets + rng.integers(1, days, stays), days)
+
+        timings = []
+        for _ in range(options["repeat"]):
+            start = time.perf_counter()
+            vectorised = daily_occupancy(
+                building_index, start_offsets, end_offsets, options["buildings"], days
+            )
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+
+        sample = min(options["naive_sample"], stays)
+        start = time.perf_counter()
+        naive = naive_occupancy(
+            building_index[:sample].tolist(),
+            start_offsets[:sample].tolist(),
+            end_offsets[:sample].tolist(),
+            options["buildings"],
+            days,
+        )
+        naive_time = (time.perf_counter() - start) * stays / sample
+
+        check = daily_occupancy(
+            building_index[:sample],
+            start_offsets[:sample],
+            end_offsets[:sample],
+            options["buildings"],
+            days,
+        )
+        if not np.array_equal(check, np.array(naive)):
+            self.stderr.write("Vectorised and naive results differ!")
+
+        self.stdout.write(
+            f"{stays} stays x {days} days over {options['buildings']} buildings "
+            f"({vectorised.sum()} occupant-days)"
+        )
+        self.stdout.write(
+            f"vectorised: {best * 1000:.1f} ms (best of {options['repeat']})"
+        )
+        self.stdout.write(f"naive loop: {naive_time * 1000:.0f} ms (extrapolated)")
+        self.stdout.write(f"speed-up:   {naive_time / best:.0f}x")
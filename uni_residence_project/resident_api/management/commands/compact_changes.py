@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from resident_api.models import ChangeLogEntry
+
+
+class Command(BaseCommand):
+    help = (
+        "Compact the change feed: drop entries older than --older-than days "
+        "that have been superseded by a newer entry for the same object. The "
+        "latest entry per object (including delete tombstones) is kept, so a "
+        "client syncing from any sequence number still converges."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than", type=int, default=7)
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["older_than"])
+        latest = (
+            ChangeLogEntry.objects.filter(
+                model=OuterRef("model"), object_id=OuterRef("object_id")
+            )
+            .order_by("-seq")
+            .values("seq")[:1]
+        )
+        superseded = ChangeLogEntry.objects.filter(changed_at__lt=cutoff).exclude(
+            seq=Subquery(latest)
+        )
+
+        total = 0
+        while True:
+            batch = list(
+                superseded.order_by("seq").values_list("seq", flat=True)[
+                    : options["batch_size"]
+                ]
+            )
+            if not batch:
+                break
+            deleted, _ = ChangeLogEntry.objects.filter(seq__in=batch).delete()
+            total += deleted
+
+        self.stdout.write(f"Removed {total} superseded change log entries.")
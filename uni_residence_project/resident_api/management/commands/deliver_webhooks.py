@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from resident_api.outbox import deliver_pending, purge_delivered
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver outbox events to webhook subscribers in batches, retrying "
+        "failed subscribers with exponential backoff."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to sleep when there is nothing to deliver.",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Run a single delivery pass."
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            delivered = deliver_pending(options["batch_size"])
+            if delivered:
+                self.stdout.write(f"Delivered {delivered} events.")
+            if options["once"]:
+                break
+            if not delivered:
+                purge_delivered()
+                time.sleep(options["interval"])
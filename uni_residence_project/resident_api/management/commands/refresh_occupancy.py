@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from resident_api.reports import refresh_daily_occupancy
+from resident_api.routers import on_shard, shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh the DailyOccupancy snapshots, recomputing only the rooms and "
+        "dates touched by resident changes since the last run plus any new days."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Drop all snapshots and rebuild them from scratch.",
+        )
+
+    def handle(self, *args, **options):
+        written = 0
+        for alias in shards():
+            with on_shard(alias):
+                written += refresh_daily_occupancy(full=options["full"])
+        self.stdout.write(f"Wrote {written} daily occupancy rows.")
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from resident_api.archive import restore_batch
+from resident_api.models import ResidentArchive
+from resident_api.routers import on_shard, shards
+
+
+class Command(BaseCommand):
+    help = "Move archived residents back into the live Resident table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--id", type=int, nargs="+", dest="ids")
+        parser.add_argument("--email", nargs="+", dest="emails")
+        parser.add_argument(
+            "--checked-out-after",
+            help="Restore everyone who checked out on or after this date.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        archived = ResidentArchive.objects.all()
+        if options["ids"]:
+            archived = archived.filter(id__in=options["ids"])
+        if options["emails"]:
+            archived = archived.filter(email__in=options["emails"])
+        if options["checked_out_after"]:
+            archived = archived.filter(check_out_date__gte=options["checked_out_after"])
+        if not archived.query.where:
+            raise CommandError(
+                "Select what to restore with --id, --email or --checked-out-after."
+            )
+
+        total = 0
+        skipped = []
+        for alias in shards():
+            with on_shard(alias):
+                while True:
+                    restored, conflicts = restore_batch(
+                        archived.exclude(id__in=skipped), options["batch_size"]
+                    )
+                    skipped += conflicts
+                    total += restored
+                    if not restored and not conflicts:
+                        break
+        for pk in skipped:
+            self.stderr.write(
+                f"Archived resident {pk} not restored: email already in use."
+            )
+        self.stdout.write(f"Restored {total} residents.")
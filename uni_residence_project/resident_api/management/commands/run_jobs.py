@@ -0,0 +1,76 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from resident_api.jobs import (
+    claim_jobs,
+    renew_leases,
+    requeue_abandoned_jobs,
+    run_job,
+)
+from resident_api.models import Job
+
+
+def _init_worker():
+    django.setup()
+    # Never share the parent's database connections with a child process.
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs (exports, imports, reports) on a pool of "
+        "worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait between polls when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty and running jobs have finished.",
+        )
+
+    def handle(self, *args, **options):
+        connections.close_all()
+        running = {}
+        with ProcessPoolExecutor(
+            max_workers=options["workers"], initializer=_init_worker
+        ) as pool:
+            while True:
+                renew_leases(running.values())
+                requeue_abandoned_jobs()
+                for job_id in claim_jobs(options["workers"] - len(running)):
+                    running[pool.submit(run_job, job_id)] = job_id
+                    self.stdout.write(f"Started job {job_id}.")
+
+                if not running:
+                    if options["once"]:
+                        break
+                    time.sleep(options["interval"])
+                    continue
+
+                done, _ = wait(
+                    running, timeout=options["interval"], return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        outcome = future.result()
+                    except Exception as e:
+                        # The worker process died before it could record this.
+                        Job.objects.filter(pk=job_id).update(
+                            status=Job.FAILED, error=str(e), finished_at=timezone.now()
+                        )
+                        outcome = Job.FAILED
+                    self.stdout.write(f"Job {job_id} {outcome}.")
@@ -0,0 +1,38 @@
+from django.conf import settings
+
+from .routers import pin_to_primary, unpin
+
+PIN_COOKIE_NAME = "pin_primary"
+UNSAFE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+class PrimaryPinningMiddleware:
+    """
+    Read-your-writes for the primary/replica router: a request that writes is
+    served from the primary, and the client gets a short-lived cookie so its
+    follow-up reads also skip the replica until replication has caught up.
+    A view can set ``request.wrote_to_primary`` when the method alone does not
+    say whether it wrote (BatchView).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        writes = request.method in UNSAFE_METHODS
+        token = pin_to_primary(writes or PIN_COOKIE_NAME in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            unpin(token)
+
+        writes = getattr(request, "wrote_to_primary", writes)
+        if writes and response.status_code < 400:
+            response.set_cookie(
+                PIN_COOKIE_NAME,
+                "1",
+                max_age=getattr(settings, "REPLICA_PIN_SECONDS", 5),
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
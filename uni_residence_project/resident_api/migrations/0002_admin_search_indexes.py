@@ -0,0 +1,38 @@
+# Generated by Django 5.1.1 on 2026-10-19 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("resident_api", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="building",
+            name="name",
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name="resident",
+            name="check_in_date",
+            field=models.DateField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name="resident",
+            name="first_name",
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name="resident",
+            name="last_name",
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name="room",
+            name="room_number",
+            field=models.CharField(db_index=True, max_length=10),
+        ),
+    ]
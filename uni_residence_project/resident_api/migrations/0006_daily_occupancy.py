@@ -0,0 +1,75 @@
+# Generated by Django 5.1.1 on 2026-10-19 13:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("resident_api", "0005_jobs"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OccupancyDirtyRange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("room_id", models.BigIntegerField()),
+                ("start_date", models.DateField()),
+                ("end_date", models.DateField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="DailyOccupancy",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(db_index=True)),
+                ("occupants", models.IntegerField()),
+                ("capacity", models.IntegerField()),
+                (
+                    "building",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="resident_api.building",
+                    ),
+                ),
+                (
+                    "room",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="resident_api.room",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["building", "date"],
+                        name="resident_ap_buildin_c86b8c_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("room", "date"), name="unique_room_date"
+                    )
+                ],
+            },
+        ),
+    ]
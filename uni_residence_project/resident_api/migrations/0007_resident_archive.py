@@ -0,0 +1,39 @@
+# Generated by Django 5.1.1 on 2026-10-19 13:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("resident_api", "0006_daily_occupancy"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="resident",
+            name="check_out_date",
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="ResidentArchive",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("first_name", models.CharField(max_length=50)),
+                ("last_name", models.CharField(max_length=50)),
+                ("email", models.EmailField(db_index=True, max_length=254)),
+                ("check_in_date", models.DateField()),
+                ("check_out_date", models.DateField(db_index=True)),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "room",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="resident_api.room",
+                    ),
+                ),
+            ],
+        ),
+    ]
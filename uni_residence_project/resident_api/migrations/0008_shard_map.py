@@ -0,0 +1,45 @@
+# Generated by Django 5.1.1 on 2026-10-19 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("resident_api", "0007_resident_archive"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ShardMap",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "model",
+                    models.CharField(
+                        choices=[
+                            ("building", "Building"),
+                            ("room", "Room"),
+                            ("resident", "Resident"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("shard", models.CharField(max_length=100)),
+                (
+                    "email",
+                    models.EmailField(
+                        blank=True, max_length=254, null=True, unique=True
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.1 on 2026-10-19 15:03
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("resident_api", "0009_job_heartbeat"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="building",
+            index=models.Index(
+                django.db.models.functions.comparison.Collate("name", "NOCASE"),
+                name="building_name_nocase",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="resident",
+            index=models.Index(
+                django.db.models.functions.comparison.Collate("first_name", "NOCASE"),
+                name="resident_first_name_nocase",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="resident",
+            index=models.Index(
+                django.db.models.functions.comparison.Collate("last_name", "NOCASE"),
+                name="resident_last_name_nocase",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="resident",
+            index=models.Index(
+                django.db.models.functions.comparison.Collate("email", "NOCASE"),
+                name="resident_email_nocase",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="room",
+            index=models.Index(
+                django.db.models.functions.comparison.Collate("room_number", "NOCASE"),
+                name="room_number_nocase",
+            ),
+        ),
+    ]
@@ -1,10 +1,15 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, router, transaction
+from django.db.models import Count
+from django.db.models.functions import Collate
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 from cryptography.fernet import Fernet
 
+from .caching import invalidate_model, reference_cache
+
 
 def encrypt_data(data):
     key = Fernet.generate_key()
@@ -35,32 +40,511 @@ class EncryptedCharField(models.CharField):
         return value
 
 
-class Building(models.Model):
-    name = models.CharField(max_length=100)
+class ChangeLogEntry(models.Model):
+    CREATE = "create"
+    UPDATE = "update"
+    DELETE = "delete"
+    ACTION_CHOICES = [(CREATE, "Create"), (UPDATE, "Update"), (DELETE, "Delete")]
+
+    # The primary key doubles as the feed's monotonically increasing sequence.
+    seq = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=6, choices=ACTION_CHOICES)
+    changed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["model", "object_id", "seq"])]
+
+    @classmethod
+    def record(cls, model, object_ids, action):
+        cls.objects.bulk_create(
+            [
+                cls(model=model._meta.model_name, object_id=pk, action=action)
+                for pk in object_ids
+            ]
+        )
+
+
+class ShardMap(models.Model):
+    """
+    Directory of the buildings, rooms and residents stored on shard databases
+    (``settings.SHARD_DATABASES``). It lives on "default".
+
+    An entry's id is the primary key of the row it describes, which keeps ids
+    unique across shards. Resident entries carry the email, so its unique
+    index keeps emails unique across shards. Rooms and residents are stored
+    on their building's shard.
+    """
+
+    BUILDING = "building"
+    ROOM = "room"
+    RESIDENT = "resident"
+    MODEL_CHOICES = [(BUILDING, "Building"), (ROOM, "Room"), (RESIDENT, "Resident")]
+
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    shard = models.CharField(max_length=100)
+    email = models.EmailField(null=True, blank=True, unique=True)
+
+    @staticmethod
+    def shards():
+        return list(getattr(settings, "SHARD_DATABASES", []))
+
+    @classmethod
+    def shard_of(cls, pk):
+        return cls.objects.filter(pk=pk).values_list("shard", flat=True).first()
+
+    @classmethod
+    def least_loaded(cls):
+        """The shard holding the fewest buildings; new buildings go there."""
+        counts = dict(
+            cls.objects.filter(model=cls.BUILDING)
+            .values_list("shard")
+            .annotate(buildings=Count("id"))
+        )
+        return min(cls.shards(), key=lambda alias: counts.get(alias, 0))
+
+    @classmethod
+    def register(cls, objs, shard):
+        """
+        Record where ``objs`` are stored. Unsaved rows are given their ids
+        here; rows that already have one (restores, updates) are re-pointed.
+        """
+        model = objs[0]._meta.model_name if objs else None
+        new = [obj for obj in objs if obj.pk is None]
+        existing = [obj for obj in objs if obj.pk is not None]
+        entries = cls.objects.bulk_create(
+            [
+                cls(model=model, shard=shard, email=getattr(obj, "email", None))
+                for obj in new
+            ]
+        )
+        for obj, entry in zip(new, entries):
+            obj.pk = entry.pk
+        for obj in existing:
+            values = {"model": model, "shard": shard}
+            values["email"] = getattr(obj, "email", None)
+            if not cls.objects.filter(pk=obj.pk).update(**values):
+                cls.objects.create(pk=obj.pk, **values)
+
+    @classmethod
+    def emails_in_use(cls, emails):
+        return set(cls.objects.filter(email__in=emails).values_list("email", flat=True))
+
+
+class ChangeTrackingQuerySet(models.QuerySet):
+    """
+    Write paths that bypass model signals still land in the change log.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        self._for_write = True
+        if objs and self.db in ShardMap.shards():
+            # The directory entries roll back if the insert on the shard fails.
+            with transaction.atomic(using=router.db_for_write(ShardMap)):
+                ShardMap.register(objs, self.db)
+                objs = super().bulk_create(objs, *args, **kwargs)
+        else:
+            objs = super().bulk_create(objs, *args, **kwargs)
+        ChangeLogEntry.record(
+            self.model, [obj.pk for obj in objs if obj.pk], ChangeLogEntry.CREATE
+        )
+        invalidate_model(self.model, self.db)
+        return objs
+
+    # bulk_update() is implemented on top of update(), so it is covered too.
+    def update(self, **kwargs):
+        self._for_write = True
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list("pk", flat=True))
+            rows = super().update(**kwargs)
+            ChangeLogEntry.record(self.model, pks, ChangeLogEntry.UPDATE)
+            invalidate_model(self.model, self.db)
+        return rows
+
+    update.alters_data = True
+
+
+class OccupancyDirtyRange(models.Model):
+    """
+    A room and date range whose DailyOccupancy rows are stale. Queued when
+    residents change and consumed by the refresh_occupancy command.
+    """
+
+    room_id = models.BigIntegerField()
+    start_date = models.DateField()
+    # NULL means the stay is still open, i.e. stale through today.
+    end_date = models.DateField(null=True)
+
+    @classmethod
+    def mark(cls, stays, using=None):
+        """Queue ``(room_id, check_in_date, check_out_date)`` tuples."""
+        cls.objects.using(using).bulk_create(
+            [
+                cls(room_id=room_id, start_date=start, end_date=end)
+                for room_id, start, end in stays
+                if room_id is not None and start is not None
+            ]
+        )
+
+
+class ResidentQuerySet(ChangeTrackingQuerySet):
+    """
+    Queue occupancy dirty ranges and publish outbox events for bulk writes,
+    which send no signals. Both the old and the new stay of every updated
+    resident are stale.
+    """
+
+    stay_fields = ("room_id", "check_in_date", "check_out_date")
+
+    def _stay(self, resident):
+        return tuple(getattr(resident, f) for f in self.stay_fields)
+
+    def bulk_create(self, objs, *args, publish=True, **kwargs):
+        """``publish=False`` skips the checked_in events, e.g. for restores."""
+        self._for_write = True
+        with transaction.atomic(using=self.db, savepoint=False), transaction.atomic(
+            using=router.db_for_write(OutboxEvent), savepoint=False
+        ):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            OccupancyDirtyRange.mark([self._stay(obj) for obj in objs], using=self.db)
+            if publish:
+                OutboxEvent.objects.bulk_create(
+                    [
+                        event
+                        for obj in objs
+                        if obj.pk
+                        for event in OutboxEvent.resident_events(obj, None)
+                    ]
+                )
+        return objs
+
+    def update(self, **kwargs):
+        if not any(
+            field in kwargs or field.removesuffix("_id") in kwargs
+            for field in self.stay_fields
+        ):
+            # No stay changes: nothing to queue or publish.
+            return super().update(**kwargs)
+        self._for_write = True
+        with transaction.atomic(using=self.db), transaction.atomic(
+            using=router.db_for_write(OutboxEvent)
+        ):
+            pks = list(self.values_list("pk", flat=True))
+            residents = self.model.objects.using(self.db).filter(pk__in=pks)
+            before = {
+                pk: dict(zip(self.stay_fields, stay))
+                for pk, *stay in residents.values_list("pk", *self.stay_fields)
+            }
+            OccupancyDirtyRange.mark(
+                [tuple(stay.values()) for stay in before.values()], using=self.db
+            )
+            rows = super().update(**kwargs)
+            after = list(residents.all())
+            OccupancyDirtyRange.mark(
+                [self._stay(resident) for resident in after], using=self.db
+            )
+            OutboxEvent.objects.bulk_create(
+                [
+                    event
+                    for resident in after
+                    for event in OutboxEvent.resident_events(
+                        resident, before[resident.pk]
+                    )
+                ]
+            )
+        return rows
+
+    update.alters_data = True
+
+
+class ShardedSaveMixin:
+    """
+    Save a building or room on a shard together with the ShardMap entry its
+    pre_save receiver writes, so a failed insert leaves no directory entry.
+    Residents get the same from their outbox transaction.
+    """
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        if using not in ShardMap.shards():
+            return super().save(*args, **kwargs)
+        with transaction.atomic(using=router.db_for_write(ShardMap)):
+            super().save(*args, **{**kwargs, "using": using})
+
+
+class Building(ShardedSaveMixin, models.Model):
+    name = models.CharField(max_length=100, db_index=True)
     address = models.TextField()
 
+    objects = ChangeTrackingQuerySet.as_manager()
+
+    class Meta:
+        # The admin's case-insensitive prefix search compiles to LIKE, which
+        # SQLite can only answer from a NOCASE index.
+        indexes = [models.Index(Collate("name", "NOCASE"), name="building_name_nocase")]
+
+    def __str__(self):
+        return self.name
 
-class Room(models.Model):
+
+class Room(ShardedSaveMixin, models.Model):
     building = models.ForeignKey(Building, on_delete=models.CASCADE)
-    room_number = models.CharField(max_length=10)
+    room_number = models.CharField(max_length=10, db_index=True)
     capacity = models.IntegerField()
 
+    objects = ChangeTrackingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(Collate("room_number", "NOCASE"), name="room_number_nocase")
+        ]
+
+    def __str__(self):
+        # Rooms are listed in <select>s; never load the building just for this.
+        if Room.building.is_cached(self):
+            return f"{self.building.name} {self.room_number}"
+        return self.room_number
+
 
 class Resident(models.Model):
-    first_name = models.CharField(max_length=50)
-    last_name = models.CharField(max_length=50)
+    first_name = models.CharField(max_length=50, db_index=True)
+    last_name = models.CharField(max_length=50, db_index=True)
     email = models.EmailField(unique=True)
     room = models.ForeignKey(Room, on_delete=models.SET_NULL, null=True)
-    check_in_date = models.DateField()
-    check_out_date = models.DateField(null=True, blank=True)
+    check_in_date = models.DateField(db_index=True)
+    check_out_date = models.DateField(null=True, blank=True, db_index=True)
+
+    objects = ResidentQuerySet.as_manager()
+
+    # Fields whose previous values are kept for the outbox and for occupancy
+    # dirty tracking.
+    tracked_fields = ("room_id", "check_in_date", "check_out_date")
+
+    class Meta:
+        indexes = [
+            models.Index(Collate(field, "NOCASE"), name=f"resident_{field}_nocase")
+            for field in ("first_name", "last_name", "email")
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: getattr(instance, name)
+            for name in cls.tracked_fields
+            if name in instance.__dict__
+        }
+        return instance
+
+    def clean_fields(self, exclude=None):
+        # The room is checked through the reference cache instead of the
+        # per-save EXISTS query ForeignKey.validate would run.
+        exclude = set(exclude or ())
+        check_room = "room" not in exclude and self.room_id is not None
+        errors = {}
+        try:
+            super().clean_fields(exclude=exclude | {"room"})
+        except ValidationError as e:
+            errors = e.update_error_dict(errors)
+        if check_room:
+            using = router.db_for_read(Room, instance=self)
+            if reference_cache(Room).get(self.room_id, using=using) is None:
+                field = self._meta.get_field("room")
+                errors.setdefault("room", []).append(
+                    ValidationError(
+                        field.error_messages["invalid"],
+                        code="invalid",
+                        params={
+                            "model": Room._meta.verbose_name,
+                            "pk": self.room_id,
+                            "field": "id",
+                            "value": self.room_id,
+                        },
+                    )
+                )
+        if errors:
+            raise ValidationError(errors)
+
     def clean(self):
         if self.check_out_date and self.check_out_date < self.check_in_date:
             raise ValidationError(_("Check-out date must be after check-in date."))
 
     def save(self, *args, **kwargs):
         self.full_clean()
+        previous = None if self._state.adding else getattr(self, "_loaded_values", {})
+        using = kwargs.get("using") or router.db_for_write(Resident, instance=self)
+        # The outbox row commits or rolls back together with the resident. When
+        # the resident is on a shard these are two transactions, committed
+        # back to back.
+        with transaction.atomic(using=using, savepoint=False), transaction.atomic(
+            using=router.db_for_write(OutboxEvent), savepoint=False
+        ):
+            super().save(*args, **kwargs)
+            OutboxEvent.record_resident_change(self, previous)
+        self._loaded_values = {
+            name: getattr(self, name) for name in self.tracked_fields
+        }
+
+
+class ResidentArchive(models.Model):
+    """
+    Cold storage for residents who checked out long ago. Rows keep the id
+    they had in Resident, so moving them back and forth is lossless.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    first_name = models.CharField(max_length=50)
+    last_name = models.CharField(max_length=50)
+    email = models.EmailField(db_index=True)
+    room = models.ForeignKey(Room, on_delete=models.SET_NULL, null=True)
+    check_in_date = models.DateField()
+    check_out_date = models.DateField(db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    copied_fields = [
+        "id",
+        "first_name",
+        "last_name",
+        "email",
+        "room_id",
+        "check_in_date",
+        "check_out_date",
+    ]
+
+    def __str__(self):
+        return f"{self.first_name} {self.last_name}"
+
+
+class DailyOccupancy(models.Model):
+    """Materialised occupants per room per day, maintained by refresh_occupancy."""
+
+    building = models.ForeignKey(Building, on_delete=models.CASCADE)
+    room = models.ForeignKey(Room, on_delete=models.CASCADE)
+    date = models.DateField(db_index=True)
+    occupants = models.IntegerField()
+    capacity = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["room", "date"], name="unique_room_date")
+        ]
+        indexes = [models.Index(fields=["building", "date"])]
+
+
+class OutboxEvent(models.Model):
+    CHECKED_IN = "resident.checked_in"
+    CHECKED_OUT = "resident.checked_out"
+    ROOM_CHANGED = "resident.room_changed"
+    EVENT_TYPES = [CHECKED_IN, CHECKED_OUT, ROOM_CHANGED]
+
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def resident_payload(resident):
+        return {
+            "resident": resident.pk,
+            "email": resident.email,
+            "room": resident.room_id,
+            "check_in_date": str(resident.check_in_date),
+            "check_out_date": (
+                str(resident.check_out_date) if resident.check_out_date else None
+            ),
+        }
+
+    @classmethod
+    def record_resident_change(cls, resident, previous):
+        events = cls.resident_events(resident, previous)
+        if events:
+            cls.objects.bulk_create(events)
+
+    @classmethod
+    def resident_events(cls, resident, previous):
+        """
+        Unsaved events for a resident that was just created (``previous`` is
+        None) or changed from the tracked ``previous`` values.
+        """
+        data = cls.resident_payload(resident)
+        events = []
+        if previous is None:
+            events.append(cls(event_type=cls.CHECKED_IN, payload=data))
+        else:
+            if "room_id" in previous and previous["room_id"] != resident.room_id:
+                events.append(
+                    cls(
+                        event_type=cls.ROOM_CHANGED,
+                        payload={**data, "previous_room": previous["room_id"]},
+                    )
+                )
+            if (
+                "check_out_date" in previous
+                and resident.check_out_date
+                and previous["check_out_date"] != resident.check_out_date
+            ):
+                events.append(cls(event_type=cls.CHECKED_OUT, payload=data))
+        return events
+
+
+class WebhookSubscriber(models.Model):
+    name = models.CharField(max_length=100)
+    url = models.URLField()
+    secret = models.CharField(max_length=100, blank=True)
+    # Comma separated OutboxEvent types; empty means every event.
+    event_types = models.CharField(max_length=200, blank=True)
+    active = models.BooleanField(default=True)
+    # Id of the last OutboxEvent delivered; new subscribers start at the head.
+    cursor = models.BigIntegerField(default=0)
+    failures = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.name
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.cursor:
+            latest = OutboxEvent.objects.order_by("-id").values_list("id", flat=True)
+            self.cursor = latest.first() or 0
         super().save(*args, **kwargs)
+
+    def subscribed_types(self):
+        return [t.strip() for t in self.event_types.split(",") if t.strip()]
+
+
+class Job(models.Model):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    input_file = models.FileField(upload_to="jobs/input/", blank=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True
+    )
+    progress = models.PositiveSmallIntegerField(default=0)
+    result = models.FileField(upload_to="jobs/result/", blank=True)
+    result_content_type = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Renewed by the run_jobs process while the job runs; see JOB_LEASE_SECONDS.
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
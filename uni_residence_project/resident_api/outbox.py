@@ -0,0 +1,124 @@
+import hashlib
+import hmac
+import json
+import logging
+import random
+from datetime import timedelta
+
+import requests
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import OutboxEvent, WebhookSubscriber
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 60 * 60
+DELIVERY_TIMEOUT_SECONDS = 10
+
+
+def backoff_delay(failures):
+    """Exponential backoff with full jitter, capped at BACKOFF_MAX_SECONDS."""
+    ceiling = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (failures - 1))
+    return timedelta(seconds=random.uniform(ceiling / 2, ceiling))
+
+
+def sign(secret, body):
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def pending_events(subscriber, batch_size):
+    """
+    The subscriber's next events, and the id its cursor moves to once they
+    are delivered. Events of types it does not subscribe to are skipped over
+    as well, so the cursor keeps up with the head and purge_delivered is not
+    held back by a filtered subscriber.
+    """
+    head = OutboxEvent.objects.order_by("-id").values_list("id", flat=True).first()
+    events = OutboxEvent.objects.filter(
+        id__gt=subscriber.cursor, id__lte=head or 0
+    ).order_by("id")
+    types = subscriber.subscribed_types()
+    if types:
+        events = events.filter(event_type__in=types)
+    events = list(events[:batch_size])
+    if len(events) == batch_size:
+        return events, events[-1].id
+    return events, max(head or 0, subscriber.cursor)
+
+
+def deliver_batch(subscriber, batch_size=100, session=requests):
+    """
+    POST the subscriber's next batch of events in one request and advance its
+    cursor on success. On failure the cursor stays put and the next attempt is
+    scheduled with backoff, so delivery is at-least-once and in order.
+    Returns the number of events delivered.
+    """
+    events, cursor = pending_events(subscriber, batch_size)
+    if not events:
+        if cursor != subscriber.cursor:
+            subscriber.cursor = cursor
+            subscriber.save(update_fields=["cursor"])
+        return 0
+
+    body = json.dumps(
+        {
+            "events": [
+                {
+                    "id": event.id,
+                    "type": event.event_type,
+                    "created_at": event.created_at,
+                    "data": event.payload,
+                }
+                for event in events
+            ]
+        },
+        cls=DjangoJSONEncoder,
+    ).encode()
+    headers = {"Content-Type": "application/json"}
+    if subscriber.secret:
+        headers["X-Webhook-Signature"] = "sha256=" + sign(subscriber.secret, body)
+
+    try:
+        response = session.post(
+            subscriber.url, data=body, headers=headers, timeout=DELIVERY_TIMEOUT_SECONDS
+        )
+        response.raise_for_status()
+    except requests.RequestException as e:
+        subscriber.failures += 1
+        subscriber.next_attempt_at = timezone.now() + backoff_delay(subscriber.failures)
+        subscriber.last_error = str(e)[:1000]
+        subscriber.save(update_fields=["failures", "next_attempt_at", "last_error"])
+        logger.warning("Webhook delivery to %s failed: %s", subscriber.name, e)
+        return 0
+
+    subscriber.cursor = cursor
+    subscriber.failures = 0
+    subscriber.next_attempt_at = None
+    subscriber.last_error = ""
+    subscriber.save(
+        update_fields=["cursor", "failures", "next_attempt_at", "last_error"]
+    )
+    return len(events)
+
+
+def deliver_pending(batch_size=100, session=requests):
+    due = WebhookSubscriber.objects.filter(active=True).filter(
+        Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=timezone.now())
+    )
+    return sum(deliver_batch(subscriber, batch_size, session) for subscriber in due)
+
+
+def purge_delivered(older_than=timedelta(days=1)):
+    """Delete events every active subscriber has already received."""
+    low_water = WebhookSubscriber.objects.filter(active=True).aggregate(
+        cursor=Min("cursor")
+    )["cursor"]
+    if low_water is None:
+        return 0
+    deleted, _ = OutboxEvent.objects.filter(
+        id__lte=low_water, created_at__lt=timezone.now() - older_than
+    ).delete()
+    return deleted
@@ -0,0 +1,118 @@
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination
+
+
+def estimate_row_count(queryset):
+    """
+    Return the planner's row estimate for an unfiltered queryset, or None when
+    no cheap estimate is available and the caller should fall back to COUNT(*).
+    """
+    if queryset.query.where or queryset.query.distinct:
+        return None
+
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [table],
+                )
+                row = cursor.fetchone()
+                return row[0] if row and row[0] >= 0 else None
+            if connection.vendor == "sqlite":
+                # Populated by ANALYZE; the first number is the table's row count.
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+                row = cursor.fetchone()
+                return int(row[0].split()[0]) if row else None
+    except DatabaseError:
+        return None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that trusts the database's statistics instead of running an
+    exact COUNT(*) over a large, unfiltered table. Filtered querysets and small
+    tables are still counted exactly.
+    """
+
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        estimate = estimate_row_count(self.object_list)
+        if estimate is None or estimate < self.exact_count_threshold:
+            return super().count
+        return estimate
+
+
+class ResidentCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the resident list: each page is a single indexed
+    range query and no COUNT(*) is ever issued, however large the table grows.
+    """
+
+    ordering = "id"
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class MergedQuerySet:
+    """
+    Read-only union of querysets over models with the same fields (or of one
+    model on several databases), ordered and filtered together. Supports just
+    what the paginators need: ``order_by``, ``filter``, ``count``, slicing and
+    ``in_bulk``. Each slice fetches at most ``stop`` rows per source and
+    merges them in Python.
+    """
+
+    def __init__(self, querysets, ordering=None):
+        if ordering is None:
+            # Keep whatever order the sources were given, else order by pk.
+            first = querysets[0]
+            if isinstance(first, MergedQuerySet):
+                ordering = first.ordering
+            else:
+                ordering = tuple(first.query.order_by) or first.model._meta.ordering
+            ordering = tuple(ordering) or ("pk",)
+            querysets = [qs.order_by(*ordering) for qs in querysets]
+        self.querysets = querysets
+        self.ordering = ordering
+
+    def order_by(self, *ordering):
+        return MergedQuerySet(
+            [qs.order_by(*ordering) for qs in self.querysets], ordering
+        )
+
+    def filter(self, *args, **kwargs):
+        return MergedQuerySet(
+            [qs.filter(*args, **kwargs) for qs in self.querysets], self.ordering
+        )
+
+    def count(self):
+        return sum(qs.count() for qs in self.querysets)
+
+    def in_bulk(self, id_list):
+        objects = {}
+        for qs in self.querysets:
+            objects.update(qs.in_bulk(id_list))
+        return objects
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice) or k.stop is None:
+            raise TypeError("MergedQuerySet only supports bounded slices.")
+        rows = [row for qs in self.querysets for row in qs[: k.stop]]
+        # Stable sorts from the last ordering key to the first.
+        for field in reversed(self.ordering):
+            rows.sort(
+                key=lambda row: (
+                    getattr(row, field.lstrip("-")) is None,
+                    getattr(row, field.lstrip("-")),
+                ),
+                reverse=field.startswith("-"),
+            )
+        return rows[k]
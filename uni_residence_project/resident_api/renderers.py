@@ -0,0 +1,23 @@
+import csv
+import io
+
+from rest_framework.renderers import BaseRenderer
+
+
+class CSVRenderer(BaseRenderer):
+    """Render a list of flat dicts as CSV, one column per key."""
+
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, list):
+            data = [data]
+        if not data:
+            return ""
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=list(data[0]))
+        writer.writeheader()
+        writer.writerows(data)
+        return output.getvalue()
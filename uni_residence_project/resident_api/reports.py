@@ -0,0 +1,288 @@
+from datetime import timedelta
+from itertools import islice
+
+import numpy as np
+from django.db import router, transaction
+from django.db.models import Max, Min, Q, Sum
+from django.utils import timezone
+
+from .models import (
+    Building,
+    DailyOccupancy,
+    OccupancyDirtyRange,
+    Resident,
+    ResidentArchive,
+    Room,
+)
+
+GRANULARITIES = ("day", "week")
+REPORT_MAX_DAYS = 731
+REFRESH_ROOM_BATCH = 500
+REFRESH_WRITE_BATCH = 2000
+
+
+def daily_occupancy(building_index, start_offsets, end_offsets, n_buildings, days):
+    """
+    Occupants per building per day, shape ``(n_buildings, days)``.
+
+    Each stay adds +1 at its first day and -1 the day after its last day in a
+    difference array; a cumulative sum along the day axis turns those edges
+    into daily head counts. Offsets are relative to the report's first day and
+    already clipped to ``[0, days]``, with ``end_offsets`` exclusive.
+    """
+    width = days + 1
+    starts = np.bincount(
+        building_index * width + start_offsets, minlength=n_buildings * width
+    )
+    ends = np.bincount(
+        building_index * width + end_offsets, minlength=n_buildings * width
+    )
+    diff = (starts - ends).reshape(n_buildings, width)
+    return np.cumsum(diff[:, :days], axis=1)
+
+
+def overlapping_stays(date_from, date_to, key, using=None, **filters):
+    """
+    ``(key, check_in_date, check_out_date)`` for every stay overlapping the
+    range, from current and archived residents alike.
+    """
+    overlapping = Q(check_in_date__lte=date_to) & (
+        Q(check_out_date__isnull=True) | Q(check_out_date__gte=date_from)
+    )
+    stays = []
+    for model in (Resident, ResidentArchive):
+        stays += (
+            model.objects.using(using)
+            .filter(overlapping, **filters)
+            .values_list(key, "check_in_date", "check_out_date")
+        )
+    return stays
+
+
+def stay_offsets(check_ins, check_outs, date_from, days):
+    """
+    Convert stay dates into the clipped ``[start, end)`` day offsets that
+    daily_occupancy expects. An open stay (no check-out) runs to the end.
+    """
+    origin = np.datetime64(date_from, "D")
+    check_ins = np.array(check_ins, dtype="datetime64[D]")
+    check_outs = np.array(check_outs, dtype="datetime64[D]")
+    start_offsets = np.clip((check_ins - origin).astype(np.int64), 0, days)
+    end_offsets = np.where(
+        np.isnat(check_outs),
+        days,
+        np.clip((check_outs - origin).astype(np.int64) + 1, 0, days),
+    )
+    return start_offsets, end_offsets
+
+
+def occupancy_report(date_from, date_to, granularity="day"):
+    """
+    Occupancy and occupancy rate per building between two dates (inclusive).
+
+    A resident occupies a room from ``check_in_date`` through
+    ``check_out_date``. Rates are against the building's total room capacity.
+    For weekly granularity occupants are the mean over each 7-day bucket
+    starting at ``date_from``, and ``peak`` is the busiest day.
+    """
+    days = (date_to - date_from).days + 1
+    buildings = list(Building.objects.order_by("id").values_list("id", "name"))
+    building_ids = np.array([pk for pk, _ in buildings], dtype=np.int64)
+    capacities = dict(
+        Room.objects.values("building_id")
+        .annotate(capacity=Sum("capacity"))
+        .values_list("building_id", "capacity")
+    )
+
+    stays = overlapping_stays(
+        date_from, date_to, "room__building_id", room__isnull=False
+    )
+    building_col, check_in_col, check_out_col = zip(*stays) if stays else ((), (), ())
+
+    start_offsets, end_offsets = stay_offsets(
+        check_in_col, check_out_col, date_from, days
+    )
+    building_index = np.searchsorted(
+        building_ids, np.array(building_col, dtype=np.int64)
+    )
+
+    occupancy = daily_occupancy(
+        building_index, start_offsets, end_offsets, len(buildings), days
+    )
+    capacity = np.array(
+        [capacities.get(pk) or 0 for pk, _ in buildings], dtype=np.float64
+    )
+
+    step = 7 if granularity == "week" else 1
+    buckets = range(0, days, step)
+    mean = np.add.reduceat(occupancy, list(buckets), axis=1) / np.diff([*buckets, days])
+    peak = np.maximum.reduceat(occupancy, list(buckets), axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.where(capacity[:, None] > 0, mean / capacity[:, None], 0.0)
+
+    return [
+        {
+            "building": pk,
+            "building_name": name,
+            "date": date_from + timedelta(days=offset),
+            "occupants": round(float(mean[b, i]), 2),
+            "peak": int(peak[b, i]),
+            "capacity": int(capacity[b]),
+            "occupancy_rate": round(float(rate[b, i]), 4),
+        }
+        for b, (pk, name) in enumerate(buildings)
+        for i, offset in enumerate(buckets)
+    ]
+
+
+def _merge(intervals, room_id, start, end):
+    if start > end:
+        return
+    current = intervals.get(room_id)
+    if current:
+        start, end = min(current[0], start), max(current[1], end)
+    intervals[room_id] = (start, end)
+
+
+def _snapshot_rows(rooms, intervals, occupancy, span_start):
+    for r, (pk, building_id, capacity) in enumerate(rooms):
+        start, end = intervals[pk]
+        first = (start - span_start).days
+        for offset in range(first, first + (end - start).days + 1):
+            yield DailyOccupancy(
+                room_id=pk,
+                building_id=building_id,
+                date=span_start + timedelta(days=offset),
+                occupants=int(occupancy[r, offset]),
+                capacity=capacity,
+            )
+
+
+def _rebuild_rooms(intervals, using):
+    """
+    Recompute and upsert DailyOccupancy rows for ``{room_id: (start, end)}``,
+    writing them REFRESH_WRITE_BATCH at a time.
+    """
+    rooms = list(
+        Room.objects.using(using)
+        .filter(id__in=list(intervals))
+        .order_by("id")
+        .values_list("id", "building_id", "capacity")
+    )
+    if not rooms:
+        return 0
+    span_start = min(intervals[pk][0] for pk, _, _ in rooms)
+    span_end = max(intervals[pk][1] for pk, _, _ in rooms)
+    days = (span_end - span_start).days + 1
+
+    stays = overlapping_stays(
+        span_start,
+        span_end,
+        "room_id",
+        using=using,
+        room_id__in=[pk for pk, _, _ in rooms],
+    )
+    room_col, check_in_col, check_out_col = zip(*stays) if stays else ((), (), ())
+    start_offsets, end_offsets = stay_offsets(
+        check_in_col, check_out_col, span_start, days
+    )
+    room_index = np.searchsorted(
+        np.array([pk for pk, _, _ in rooms], dtype=np.int64),
+        np.array(room_col, dtype=np.int64),
+    )
+    occupancy = daily_occupancy(
+        room_index, start_offsets, end_offsets, len(rooms), days
+    )
+
+    written = 0
+    rows = _snapshot_rows(rooms, intervals, occupancy, span_start)
+    while chunk := list(islice(rows, REFRESH_WRITE_BATCH)):
+        DailyOccupancy.objects.using(using).bulk_create(
+            chunk,
+            update_conflicts=True,
+            unique_fields=["room", "date"],
+            update_fields=["building", "occupants", "capacity"],
+        )
+        written += len(chunk)
+    return written
+
+
+def refresh_daily_occupancy(today=None, full=False):
+    """
+    Bring DailyOccupancy up to date through ``today`` (rebuilding it from
+    scratch with ``full``).
+
+    Only two kinds of cells are recomputed: the room/date ranges queued in
+    OccupancyDirtyRange since the last run, and the days after the last
+    materialised date (for every room), which are queued first. Rooms are
+    then rebuilt REFRESH_ROOM_BATCH at a time, each batch committing its rows
+    and deleting the dirty ranges it consumed, so an interrupted run resumes
+    where it stopped. Room capacity and building are taken as they are at
+    refresh time. Returns the number of rows written.
+    """
+    today = today or timezone.localdate()
+    db = router.db_for_write(DailyOccupancy)
+
+    with transaction.atomic(using=db):
+        if full:
+            DailyOccupancy.objects.using(db).all().delete()
+        last_day = DailyOccupancy.objects.using(db).aggregate(last=Max("date"))["last"]
+        if last_day is not None:
+            horizon_start = last_day + timedelta(days=1)
+        else:
+            firsts = [
+                model.objects.using(db).aggregate(first=Min("check_in_date"))["first"]
+                for model in (Resident, ResidentArchive)
+            ]
+            horizon_start = min([first for first in firsts if first] + [today])
+        if horizon_start <= today:
+            OccupancyDirtyRange.mark(
+                [
+                    (room_id, horizon_start, today)
+                    for room_id in Room.objects.using(db).values_list("id", flat=True)
+                ],
+                using=db,
+            )
+
+    dirty = OccupancyDirtyRange.objects.using(db)
+    last_dirty = dirty.aggregate(last=Max("id"))["last"]
+    if last_dirty is None:
+        return 0
+    dirty = dirty.filter(id__lte=last_dirty)
+    intervals = {}
+    room_ids = set()
+    for room_id, start, end in dirty.values_list("room_id", "start_date", "end_date"):
+        room_ids.add(room_id)
+        _merge(intervals, room_id, start, min(end or today, today))
+
+    written = 0
+    room_ids = sorted(room_ids)
+    for i in range(0, len(room_ids), REFRESH_ROOM_BATCH):
+        batch = room_ids[i : i + REFRESH_ROOM_BATCH]
+        with transaction.atomic(using=db):
+            written += _rebuild_rooms(
+                {pk: intervals[pk] for pk in batch if pk in intervals}, db
+            )
+            dirty.filter(room_id__in=batch).delete()
+    return written
+
+
+def occupancy_history(date_from, date_to, building=None):
+    """Per-building daily occupancy read from the DailyOccupancy snapshots."""
+    snapshots = DailyOccupancy.objects.filter(date__range=(date_from, date_to))
+    if building is not None:
+        snapshots = snapshots.filter(building_id=building)
+    return [
+        {
+            "building": row["building_id"],
+            "date": row["date"],
+            "occupants": row["occupants"],
+            "capacity": row["capacity"],
+            "occupancy_rate": (
+                round(row["occupants"] / row["capacity"], 4) if row["capacity"] else 0.0
+            ),
+        }
+        for row in snapshots.values("building_id", "date")
+        .annotate(occupants=Sum("occupants"), capacity=Sum("capacity"))
+        .order_by("building_id", "date")
+    ]
@@ -0,0 +1,148 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .models import ShardMap
+
+# Set for the remainder of a request once it has written to the primary, or
+# when the client is still inside its read-your-writes window. None outside a
+# request (PrimaryPinningMiddleware), where writes pin nothing.
+_pinned_to_primary = contextvars.ContextVar("pinned_to_primary", default=None)
+
+# The shard a request or command is working on; None to let the router pick.
+_current_shard = contextvars.ContextVar("current_shard", default=None)
+
+# Read from the replica. The job queue, shard directory, outbox and change log
+# are always read from "default": their readers cannot tolerate lag.
+REPLICA_ROUTED_MODELS = {"building", "room", "resident", "residentarchive"}
+
+# Everything that belongs to a building lives on the building's shard.
+SHARDED_MODELS = {
+    "building",
+    "room",
+    "resident",
+    "residentarchive",
+    "dailyoccupancy",
+    "occupancydirtyrange",
+}
+
+
+def pin_to_primary(pinned=True):
+    return _pinned_to_primary.set(pinned)
+
+
+def unpin(token):
+    _pinned_to_primary.reset(token)
+
+
+def is_pinned_to_primary():
+    return bool(_pinned_to_primary.get())
+
+
+def use_shard(alias):
+    return _current_shard.set(alias)
+
+
+def reset_shard(token):
+    _current_shard.reset(token)
+
+
+def current_shard():
+    return _current_shard.get()
+
+
+@contextmanager
+def on_shard(alias):
+    token = use_shard(alias)
+    try:
+        yield
+    finally:
+        reset_shard(token)
+
+
+def shards():
+    """The shard aliases to visit in turn, or ``[None]`` when unsharded."""
+    return ShardMap.shards() or [None]
+
+
+class ShardRouter:
+    """
+    Keep each building, with its rooms, residents and occupancy rows, on the
+    shard ShardMap assigns it. Rows already loaded from a shard stay there,
+    new rows follow their building or room, and anything else goes to the
+    current shard (see on_shard). New buildings with no current shard are
+    placed on the least loaded one. Inactive unless SHARD_DATABASES is set.
+    """
+
+    def _shard(self, model, hints):
+        aliases = ShardMap.shards()
+        if not aliases or model._meta.model_name not in SHARDED_MODELS:
+            return None
+        instance = hints.get("instance")
+        if instance is not None:
+            if instance._state.db in aliases:
+                return instance._state.db
+            for field in ("building_id", "room_id"):
+                related = getattr(instance, field, None)
+                if related is not None:
+                    shard = ShardMap.shard_of(related)
+                    if shard:
+                        return shard
+        return current_shard()
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        shard = self._shard(model, hints)
+        if shard is None and ShardMap.shards():
+            if model._meta.model_name in SHARDED_MODELS:
+                return ShardMap.least_loaded()
+        return shard
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = ShardMap.shards()
+        if obj1._state.db in aliases or obj2._state.db in aliases:
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+class PrimaryReplicaRouter:
+    """
+    Send reads of the residence models to a replica and every write to the
+    primary ("default"). Once a request has written, its remaining reads stick
+    to the primary so a client always sees its own changes.
+    """
+
+    def _replica(self):
+        replicas = getattr(settings, "REPLICA_DATABASES", [])
+        return replicas[0] if replicas else None
+
+    def db_for_read(self, model, **hints):
+        if model._meta.model_name not in REPLICA_ROUTED_MODELS:
+            return None
+        if is_pinned_to_primary():
+            return "default"
+        return self._replica()
+
+    def db_for_write(self, model, **hints):
+        if (
+            model._meta.model_name in REPLICA_ROUTED_MODELS
+            and _pinned_to_primary.get() is False
+        ):
+            # Reset with the request's token by the middleware.
+            _pinned_to_primary.set(True)
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {"default", *getattr(settings, "REPLICA_DATABASES", [])}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
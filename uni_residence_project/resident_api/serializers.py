@@ -1,5 +1,28 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
-from .models import Building, Room, Resident
+from .caching import reference_cache
+from .models import Building, Job, Room, Resident, ResidentArchive, ShardMap
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves the related row through the in-process reference cache, so
+    validating a write does not query the related table. Only meant for
+    unfiltered querysets.
+    """
+
+    def to_internal_value(self, data):
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        try:
+            if isinstance(data, bool):
+                raise TypeError
+            obj = reference_cache(self.get_queryset().model).get(data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        if obj is None:
+            self.fail("does_not_exist", pk_value=data)
+        return obj
 
 
 class BuildingSerializer(serializers.ModelSerializer):
@@ -9,12 +32,87 @@ class BuildingSerializer(serializers.ModelSerializer):
 
 
 class RoomSerializer(serializers.ModelSerializer):
+    serializer_related_field = CachedPrimaryKeyRelatedField
+
     class Meta:
         model = Room
         fields = "__all__"
 
 
 class ResidentSerializer(serializers.ModelSerializer):
+    serializer_related_field = CachedPrimaryKeyRelatedField
+
     class Meta:
         model = Resident
         fields = "__all__"
+        # The browsable API lists every room as "<building> <number>".
+        extra_kwargs = {"room": {"queryset": Room.objects.select_related("building")}}
+
+    def validate_email(self, value):
+        # The unique index on Resident.email only covers one shard.
+        if ShardMap.shards():
+            in_use = ShardMap.objects.filter(email=value)
+            if self.instance is not None:
+                in_use = in_use.exclude(pk=self.instance.pk)
+            if in_use.exists():
+                raise serializers.ValidationError(
+                    "resident with this email already exists."
+                )
+        return value
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Archived rows are only returned with ?include_archived=true.
+        if isinstance(instance, ResidentArchive):
+            data["archived_at"] = instance.archived_at
+        return data
+
+
+class JobSerializer(serializers.ModelSerializer):
+    result_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            "id",
+            "kind",
+            "params",
+            "input_file",
+            "status",
+            "progress",
+            "result_url",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+        read_only_fields = [
+            "status",
+            "progress",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+        extra_kwargs = {"input_file": {"write_only": True, "required": False}}
+
+    def get_result_url(self, obj):
+        if obj.status != Job.SUCCEEDED:
+            return None
+        return self.context["request"].build_absolute_uri(f"/api/jobs/{obj.pk}/result/")
+
+    def validate_kind(self, value):
+        from .jobs import JOB_HANDLERS
+
+        if value not in JOB_HANDLERS:
+            raise serializers.ValidationError(
+                f"Unknown job kind. Choose one of: {', '.join(JOB_HANDLERS)}."
+            )
+        return value
+
+    def validate(self, attrs):
+        if attrs.get("kind") == "import_residents" and not attrs.get("input_file"):
+            raise serializers.ValidationError(
+                {"input_file": ["An import needs a CSV file."]}
+            )
+        return attrs
@@ -0,0 +1,101 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .caching import invalidate_model
+from .models import (
+    Building,
+    ChangeLogEntry,
+    OccupancyDirtyRange,
+    OutboxEvent,
+    Resident,
+    Room,
+    ShardMap,
+)
+
+
+# Connected per model: a sender-less post_delete receiver would stop Django
+# from fast-deleting every other model (outbox purges, log compaction, ...).
+@receiver(post_save, sender=Building)
+@receiver(post_save, sender=Room)
+@receiver(post_save, sender=Resident)
+def record_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    action = ChangeLogEntry.CREATE if created else ChangeLogEntry.UPDATE
+    ChangeLogEntry.record(sender, [instance.pk], action)
+
+
+@receiver(post_delete, sender=Building)
+@receiver(post_delete, sender=Room)
+@receiver(post_delete, sender=Resident)
+def record_delete(sender, instance, **kwargs):
+    ChangeLogEntry.record(sender, [instance.pk], ChangeLogEntry.DELETE)
+
+
+@receiver(post_save, sender=Building)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Building)
+@receiver(post_delete, sender=Room)
+def invalidate_cached_responses(sender, using=None, **kwargs):
+    invalidate_model(sender, using)
+
+
+@receiver(pre_save, sender=Building)
+@receiver(pre_save, sender=Room)
+@receiver(pre_save, sender=Resident)
+def register_sharded_row(sender, instance, raw=False, using=None, **kwargs):
+    if not raw and using in ShardMap.shards():
+        ShardMap.register([instance], using)
+
+
+@receiver(post_delete, sender=Building)
+@receiver(post_delete, sender=Room)
+@receiver(post_delete, sender=Resident)
+def forget_sharded_row(sender, instance, using=None, **kwargs):
+    if using in ShardMap.shards():
+        ShardMap.objects.filter(pk=instance.pk).delete()
+
+
+@receiver(pre_delete, sender=Room)
+def record_room_vacated(sender, instance, using=None, **kwargs):
+    # Deleting a room sets its residents' room to NULL with a plain UPDATE
+    # that sends no signals.
+    residents = list(Resident.objects.using(using).filter(room_id=instance.pk))
+    ChangeLogEntry.record(
+        Resident, [resident.pk for resident in residents], ChangeLogEntry.UPDATE
+    )
+    events = []
+    for resident in residents:
+        resident.room_id = None
+        events += OutboxEvent.resident_events(resident, {"room_id": instance.pk})
+    OutboxEvent.objects.bulk_create(events)
+
+
+@receiver(post_save, sender=Resident)
+def mark_occupancy_dirty_on_save(
+    sender, instance, created, raw=False, using=None, **kwargs
+):
+    if raw:
+        return
+    stay = (instance.room_id, instance.check_in_date, instance.check_out_date)
+    # Resident.save refreshes _loaded_values after post_save, so these are
+    # still the values the row had before this save.
+    previous = {} if created else getattr(instance, "_loaded_values", {})
+    stays = [stay]
+    if previous:
+        old_stay = tuple(
+            previous.get(name)
+            for name in ("room_id", "check_in_date", "check_out_date")
+        )
+        if old_stay == stay:
+            return
+        stays.append(old_stay)
+    OccupancyDirtyRange.mark(stays, using=using)
+
+
+@receiver(post_delete, sender=Resident)
+def mark_occupancy_dirty_on_delete(sender, instance, using=None, **kwargs):
+    OccupancyDirtyRange.mark(
+        [(instance.room_id, instance.check_in_date, instance.check_out_date)],
+        using=using,
+    )
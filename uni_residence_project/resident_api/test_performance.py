@@ -0,0 +1,209 @@
+import difflib
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from .testing import LOCMEM_CACHE, APITestCase, capture_queries
+
+from .models import User, Building, Room, Resident
+
+AUTH = 'FROM "authtoken_token"'
+RESIDENT = 'FROM "resident_api_resident"'
+ROOM = 'FROM "resident_api_room"'
+BUILDING = 'FROM "resident_api_building"'
+
+
+class QueryBudgetMixin:
+    """
+    Assertions for the performance test layer.
+
+    ``assertQueries`` takes one pattern per query the block is allowed to run,
+    in order. Each captured statement must contain its pattern; on failure the
+    message is a diff of the expected patterns against the SQL that ran, so an
+    N+1 or an extra auth lookup shows up as the offending statements.
+    """
+
+    # Wall-clock budget per request, generous enough for a loaded CI box.
+    response_time_budget = 0.5
+
+    @contextmanager
+    def assertQueries(self, expected):
+        with capture_queries() as ctx:
+            yield ctx
+
+        actual = [query["sql"] for query in ctx.captured_queries]
+        rendered = [
+            expected[i] if i < len(expected) and expected[i] in sql else sql
+            for i, sql in enumerate(actual)
+        ]
+        if rendered == list(expected):
+            return
+
+        diff = "\n".join(
+            difflib.unified_diff(
+                list(expected),
+                rendered,
+                fromfile="query budget",
+                tofile="executed SQL",
+                lineterm="",
+            )
+        )
+        self.fail(
+            f"Expected {len(expected)} queries, {len(actual)} were executed:\n{diff}"
+        )
+
+    def assertNoCountQuery(self, ctx):
+        counts = [q["sql"] for q in ctx.captured_queries if "COUNT(" in q["sql"]]
+        self.assertEqual(counts, [], "Unexpected COUNT query")
+
+    @contextmanager
+    def assertResponseTime(self, budget=None):
+        budget = budget or self.response_time_budget
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        self.assertLess(
+            elapsed, budget, f"Request took {elapsed:.3f}s, budget is {budget:.3f}s"
+        )
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class EndpointQueryBudgetTests(QueryBudgetMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        cls.token = Token.objects.create(user=cls.admin_user)
+
+        cls.buildings = Building.objects.bulk_create(
+            [Building(name=f"Building {n}", address=f"{n} Test St") for n in range(3)]
+        )
+        cls.rooms = Room.objects.bulk_create(
+            [
+                Room(building=building, room_number=str(n), capacity=2)
+                for building in cls.buildings
+                for n in range(40)
+            ]
+        )
+        cls.residents = Resident.objects.bulk_create(
+            [
+                Resident(
+                    first_name="Jane",
+                    last_name=f"Doe{n}",
+                    email=f"jane{n}@example.com",
+                    room=cls.rooms[n % len(cls.rooms)],
+                    check_in_date="2023-01-01",
+                )
+                for n in range(300)
+            ]
+        )
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def test_list_residents_budget_per_page_size(self):
+        for page_size in (10, 50, 100):
+            with self.subTest(page_size=page_size):
+                with self.assertResponseTime():
+                    with self.assertQueries([AUTH, RESIDENT]) as ctx:
+                        response = self.client.get(
+                            "/api/residents/", {"page_size": page_size}
+                        )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(len(response.data["results"]), page_size)
+                self.assertNoCountQuery(ctx)
+
+    def test_list_residents_next_page_budget(self):
+        response = self.client.get("/api/residents/", {"page_size": 50})
+        with self.assertQueries([AUTH, RESIDENT]) as ctx:
+            response = self.client.get(response.data["next"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNoCountQuery(ctx)
+
+    def test_filtered_resident_list_budget(self):
+        # django-filter validates the room id before filtering.
+        with self.assertQueries([AUTH, ROOM, RESIDENT]):
+            response = self.client.get(
+                "/api/residents/", {"room": self.rooms[0].id, "search": "Doe"}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_resident_budget(self):
+        with self.assertResponseTime():
+            with self.assertQueries([AUTH, RESIDENT]):
+                response = self.client.get(f"/api/residents/{self.residents[0].id}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_batch_retrieve_residents_budget(self):
+        ids = ",".join(str(resident.id) for resident in self.residents[:30])
+        with self.assertQueries([AUTH, RESIDENT]):
+            response = self.client.get("/api/residents/", {"id__in": ids})
+        self.assertEqual(len(response.data), 30)
+
+    def test_list_rooms_budget(self):
+        # Page-number pagination: COUNT(*), then the page itself.
+        with self.assertResponseTime():
+            with self.assertQueries([AUTH, ROOM, ROOM]):
+                response = self.client.get("/api/rooms/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_buildings_budget(self):
+        with self.assertQueries([AUTH, BUILDING, BUILDING]):
+            response = self.client.get("/api/buildings/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(CACHES=LOCMEM_CACHE)
+    def test_create_resident_budget(self):
+        resident_data = {
+            "first_name": "John",
+            "last_name": "Doe",
+            "email": "john.doe@example.com",
+            "room": self.rooms[0].id,
+            "check_in_date": "2023-01-01",
+        }
+        # The room comes from the in-process reference cache, so only the
+        # email check runs twice (serializer, then Resident.full_clean).
+        self.addCleanup(cache.clear)
+        self.client.post(
+            "/api/residents/",
+            {**resident_data, "email": "warm.up@example.com"},
+            format="json",
+        )
+        with self.assertResponseTime():
+            with self.assertQueries(
+                [
+                    AUTH,
+                    RESIDENT,
+                    RESIDENT,
+                    'INSERT INTO "resident_api_resident"',
+                    'INSERT INTO "resident_api_changelogentry"',
+                    'INSERT INTO "resident_api_occupancydirtyrange"',
+                    'INSERT INTO "resident_api_outboxevent"',
+                ]
+            ):
+                response = self.client.post(
+                    "/api/residents/", resident_data, format="json"
+                )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_browsable_resident_list_is_flat_in_rooms(self):
+        # The HTML form renders a <select> of every room and the filter form
+        # one of rooms and buildings; none may cost a query per option.
+        def html_queries():
+            with capture_queries() as ctx:
+                response = self.client.get("/api/residents/", HTTP_ACCEPT="text/html")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(ctx.captured_queries)
+
+        before = html_queries()
+        Room.objects.bulk_create(
+            [
+                Room(building=self.buildings[0], room_number=f"x{n}", capacity=1)
+                for n in range(50)
+            ]
+        )
+        self.assertEqual(html_queries(), before)
@@ -0,0 +1,277 @@
+import csv
+import io
+import json
+import tempfile
+from unittest.mock import patch
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connections, transaction
+from django.db.models import QuerySet
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+
+from .models import (
+    User,
+    Building,
+    DailyOccupancy,
+    Job,
+    Room,
+    Resident,
+    ResidentArchive,
+    ShardMap,
+)
+from .jobs import claim_jobs, run_job
+from .testing import APITestCase
+
+
+# The test settings always define two shard databases; sharding is only
+# switched on here.
+@override_settings(SHARD_DATABASES=["shard_0", "shard_1"])
+class ShardingTests(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        self.token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        self.buildings = [
+            self.client.post(
+                "/api/buildings/",
+                {"name": f"Building {n}", "address": f"{n} Test St"},
+                format="json",
+            ).data
+            for n in range(2)
+        ]
+        self.rooms = [
+            self.client.post(
+                "/api/rooms/",
+                {"building": building["id"], "room_number": "1", "capacity": 2},
+                format="json",
+            ).data
+            for building in self.buildings
+        ]
+        self.residents = [
+            self.client.post(
+                "/api/residents/",
+                {
+                    "first_name": "Jane",
+                    "last_name": last_name,
+                    "email": f"{last_name.lower()}@example.com",
+                    "room": room["id"],
+                    "check_in_date": "2023-01-01",
+                },
+                format="json",
+            ).data
+            for room in self.rooms
+            for last_name in (f"A{room['id']}", f"Z{room['id']}")
+        ]
+
+    def shard_of(self, obj):
+        return ShardMap.shard_of(obj["id"])
+
+    def test_building_rooms_and_residents_share_a_shard(self):
+        first, second = (self.shard_of(building) for building in self.buildings)
+        self.assertNotEqual(first, second)
+        for room, building in zip(self.rooms, self.buildings):
+            self.assertEqual(self.shard_of(room), self.shard_of(building))
+            self.assertTrue(
+                Room.objects.using(self.shard_of(building))
+                .filter(pk=room["id"])
+                .exists()
+            )
+        resident = self.residents[-1]
+        shard = self.shard_of(self.buildings[1])
+        self.assertTrue(
+            Resident.objects.using(shard).filter(pk=resident["id"]).exists()
+        )
+        self.assertFalse(
+            Resident.objects.using(first).filter(pk=resident["id"]).exists()
+        )
+        self.assertFalse(Building.objects.using("default").exists())
+
+    def test_ids_are_unique_across_shards(self):
+        ids = [obj["id"] for obj in [*self.buildings, *self.rooms, *self.residents]]
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_list_filtered_by_building_reads_one_shard(self):
+        building = self.buildings[0]
+        other = self.shard_of(self.buildings[1])
+        with CaptureQueriesContext(connections[other]) as ctx:
+            response = self.client.get("/api/rooms/", {"building": building["id"]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [room["id"] for room in response.data["results"]], [self.rooms[0]["id"]]
+        )
+        self.assertEqual(ctx.captured_queries, [])
+
+    def test_unfiltered_list_merges_shards_in_order(self):
+        response = self.client.get("/api/residents/", {"ordering": "last_name"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [row["last_name"] for row in response.data["results"]]
+        self.assertEqual(names, sorted(r["last_name"] for r in self.residents))
+
+        ids = []
+        url = "/api/residents/?page_size=3"
+        while url:
+            response = self.client.get(url)
+            ids += [row["id"] for row in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(ids, sorted(r["id"] for r in self.residents))
+
+        response = self.client.get("/api/rooms/")
+        self.assertEqual(response.data["count"], 2)
+
+    def test_email_is_unique_across_shards(self):
+        response = self.client.post(
+            "/api/residents/",
+            {
+                "first_name": "John",
+                "last_name": "Doe",
+                "email": self.residents[0]["email"],
+                "room": self.rooms[1]["id"],
+                "check_in_date": "2023-01-01",
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("email", response.data)
+
+    def test_detail_routes_use_the_object_shard(self):
+        resident = self.residents[-1]
+        url = f"/api/residents/{resident['id']}/"
+        self.assertEqual(self.client.get(url).data["email"], resident["email"])
+        response = self.client.patch(url, {"last_name": "Smith"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertIsNone(ShardMap.shard_of(resident["id"]))
+        # The email can be used again.
+        response = self.client.post(
+            "/api/residents/",
+            {**resident, "id": None, "room": self.rooms[0]["id"]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_occupancy_report_covers_every_shard(self):
+        response = self.client.get(
+            "/api/buildings/occupancy-report/",
+            {"from": "2023-01-01", "to": "2023-01-01"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [row["building"] for row in response.data],
+            [building["id"] for building in self.buildings],
+        )
+        self.assertEqual([row["occupants"] for row in response.data], [2, 2])
+
+    def test_maintenance_commands_visit_every_shard(self):
+        for resident in self.residents[::2]:
+            self.client.patch(
+                f"/api/residents/{resident['id']}/",
+                {"check_out_date": "2023-01-31"},
+                format="json",
+            )
+        call_command("archive_residents", older_than_days=30, stdout=io.StringIO())
+        for building in self.buildings:
+            shard = self.shard_of(building)
+            self.assertEqual(ResidentArchive.objects.using(shard).count(), 1)
+            self.assertEqual(Resident.objects.using(shard).count(), 1)
+        response = self.client.get("/api/residents/", {"include_archived": "true"})
+        self.assertEqual(len(response.data["results"]), 4)
+
+        call_command("refresh_occupancy", stdout=io.StringIO())
+        for building in self.buildings:
+            rows = DailyOccupancy.objects.using(self.shard_of(building))
+            self.assertEqual(
+                set(rows.values_list("building_id", flat=True)), {building["id"]}
+            )
+
+    def test_failed_shard_insert_leaves_no_directory_entry(self):
+        insert = QuerySet._insert
+
+        def insert_on_default_only(queryset, *args, using=None, **kwargs):
+            if using != "default":
+                raise DatabaseError("shard unavailable")
+            return insert(queryset, *args, using=using, **kwargs)
+
+        entries = ShardMap.objects.count()
+        rooms = [
+            Room(building_id=self.buildings[0]["id"], room_number=str(n), capacity=1)
+            for n in range(2)
+        ]
+        for write in (
+            lambda: Building.objects.create(name="Building 2", address="2 Test St"),
+            lambda: Room.objects.using(self.shard_of(self.buildings[0])).bulk_create(
+                rooms
+            ),
+        ):
+            with (
+                patch.object(QuerySet, "_insert", insert_on_default_only),
+                self.assertRaises(DatabaseError),
+                # The test transactions on the shards survive the error.
+                transaction.atomic(using="shard_0"),
+                transaction.atomic(using="shard_1"),
+            ):
+                write()
+        self.assertEqual(ShardMap.objects.count(), entries)
+
+    def test_jobs_visit_every_shard(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        upload = SimpleUploadedFile(
+            "residents.csv",
+            (
+                "first_name,last_name,email,room_id,check_in_date\n"
+                + "".join(
+                    f"New,Resident,new{room['id']}@example.com,{room['id']},2023-01-01\n"
+                    for room in self.rooms
+                )
+                + f"Dup,Licate,{self.residents[-1]['email']},,2023-01-01\n"
+            ).encode(),
+            content_type="text/csv",
+        )
+        self.client.post(
+            "/api/jobs/",
+            {"kind": "import_residents", "input_file": upload},
+            format="multipart",
+        )
+        for job_id in claim_jobs(10):
+            run_job(job_id)
+        for kind in ("export_residents", "occupancy_report"):
+            self.client.post("/api/jobs/", {"kind": kind}, format="json")
+        for job_id in claim_jobs(10):
+            run_job(job_id)
+        imported, exported, report = Job.objects.order_by("id")
+        self.assertEqual(
+            [job.status for job in (imported, exported, report)], [Job.SUCCEEDED] * 3
+        )
+
+        summary = json.loads(imported.result.read())
+        self.assertEqual(summary["created"], 2)
+        self.assertEqual([e["line"] for e in summary["errors"]], [4])
+        for room in self.rooms:
+            shard = self.shard_of(room)
+            self.assertTrue(
+                Resident.objects.using(shard)
+                .filter(email=f"new{room['id']}@example.com", room_id=room["id"])
+                .exists()
+            )
+
+        rows = list(csv.DictReader(io.StringIO(exported.result.read().decode())))
+        ids = [int(row["id"]) for row in rows]
+        self.assertEqual(len(ids), 6)
+        self.assertEqual(ids, sorted(ids))
+
+        rows = list(csv.DictReader(io.StringIO(report.result.read().decode())))
+        self.assertEqual(
+            [int(row["building_id"]) for row in rows],
+            [building["id"] for building in self.buildings],
+        )
+        self.assertEqual([row["occupants"] for row in rows], ["3", "3"])
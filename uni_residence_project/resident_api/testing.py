@@ -0,0 +1,53 @@
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+from rest_framework import test
+
+# For tests that need a shared cache without a memcached server.
+LOCMEM_CACHE = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "resident-api-tests",
+    }
+}
+
+
+class APITestCase(test.APITestCase):
+    # Reads may be routed to a replica or a shard when those are configured.
+    databases = "__all__"
+
+
+class APITransactionTestCase(test.APITransactionTestCase):
+    databases = "__all__"
+
+
+@contextmanager
+def wrap_all_connections(wrapper):
+    """Install an execute wrapper on every database's connection (this thread)."""
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(wrapper))
+        yield
+
+
+class capture_queries:
+    """
+    Like CaptureQueriesContext, but for every database at once and in the
+    order the statements ran, so a read sent to a replica or shard is counted.
+    Statements are recorded with their placeholders.
+    """
+
+    def __enter__(self):
+        self.captured_queries = []
+
+        def record(execute, sql, params, many, context):
+            alias = context["connection"].alias
+            self.captured_queries.append({"sql": sql, "alias": alias})
+            return execute(sql, params, many, context)
+
+        self._wrapped = wrap_all_connections(record)
+        self._wrapped.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._wrapped.__exit__(*exc_info)
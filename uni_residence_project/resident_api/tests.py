@@ -1,8 +1,73 @@
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from datetime import date, timedelta
+
+import numpy as np
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connections
+from django.utils import timezone
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
-from rest_framework.test import APITestCase
-from .models import User, Building, Room, Resident
+from rest_framework.test import APIClient
+from .testing import (
+    LOCMEM_CACHE,
+    APITestCase,
+    APITransactionTestCase,
+    capture_queries,
+    wrap_all_connections,
+)
+from .models import (
+    User,
+    Building,
+    ChangeLogEntry,
+    DailyOccupancy,
+    Job,
+    OccupancyDirtyRange,
+    OutboxEvent,
+    Room,
+    Resident,
+    ResidentArchive,
+    ShardMap,
+    WebhookSubscriber,
+)
+from .archive import archive_batch
+from .caching import ReferenceCache, reference_cache, single_flight
+from .jobs import (
+    RESIDENT_COLUMNS,
+    claim_jobs,
+    export_residents,
+    renew_leases,
+    requeue_abandoned_jobs,
+    run_job,
+)
+from .outbox import deliver_pending, purge_delivered, sign
+from . import reports
+from .reports import daily_occupancy, refresh_daily_occupancy
+from .routers import (
+    PrimaryReplicaRouter,
+    ShardRouter,
+    on_shard,
+    pin_to_primary,
+    unpin,
+)
 from rest_framework.authtoken.models import Token
 from unittest.mock import patch
+from django.db.models.deletion import Collector
+from .log import BackgroundRotatingFileHandler, JsonFormatter, SamplingFilter
+from .pagination import EstimatedCountPaginator
 from oauth2_provider.models import Application  # Add this import
 
 
@@ -216,6 +281,1442 @@ class ResidentViewSetTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
 
+@override_settings(REPLICA_DATABASES=["replica"])
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.pin_token = pin_to_primary(False)
+
+    def tearDown(self):
+        unpin(self.pin_token)
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Resident), "replica")
+        self.assertEqual(self.router.db_for_read(Room), "replica")
+        self.assertEqual(self.router.db_for_read(Building), "replica")
+        self.assertEqual(self.router.db_for_read(ResidentArchive), "replica")
+
+    def test_queue_directory_and_cursors_are_not_routed(self):
+        for model in (Job, ShardMap, OutboxEvent, WebhookSubscriber, ChangeLogEntry):
+            self.assertIsNone(self.router.db_for_read(model))
+        # Writing a job does not pin the request's reads.
+        self.assertEqual(self.router.db_for_write(Job), "default")
+        self.assertEqual(self.router.db_for_read(Resident), "replica")
+
+    def test_other_apps_are_not_routed(self):
+        self.assertIsNone(self.router.db_for_read(User))
+        self.assertIsNone(self.router.db_for_read(Token))
+
+    def test_reads_stick_to_primary_after_write(self):
+        self.assertEqual(self.router.db_for_write(Resident), "default")
+        self.assertEqual(self.router.db_for_read(Resident), "default")
+
+    def test_pinned_reads_go_to_primary(self):
+        token = pin_to_primary()
+        self.assertEqual(self.router.db_for_read(Room), "default")
+        unpin(token)
+        self.assertEqual(self.router.db_for_read(Room), "replica")
+
+    def test_writes_outside_a_request_do_not_pin(self):
+        # e.g. run_jobs or deliver_webhooks, which run without the middleware.
+        token = pin_to_primary(None)
+        self.assertEqual(self.router.db_for_write(Resident), "default")
+        self.assertEqual(self.router.db_for_read(Resident), "replica")
+        unpin(token)
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_no_replica_configured(self):
+        self.assertIsNone(self.router.db_for_read(Resident))
+
+
+@override_settings(SHARD_DATABASES=["shard_a", "shard_b"])
+class ShardRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ShardRouter()
+
+    def test_current_shard_is_used(self):
+        with on_shard("shard_b"):
+            self.assertEqual(self.router.db_for_read(Room), "shard_b")
+            self.assertEqual(self.router.db_for_write(Resident), "shard_b")
+        self.assertIsNone(self.router.db_for_read(Room))
+
+    def test_loaded_rows_stay_on_their_shard(self):
+        resident = Resident()
+        resident._state.db = "shard_a"
+        with on_shard("shard_b"):
+            self.assertEqual(
+                self.router.db_for_write(Resident, instance=resident), "shard_a"
+            )
+
+    def test_relations_stay_within_a_shard(self):
+        room, resident = Room(), Resident()
+        room._state.db, resident._state.db = "shard_a", "shard_b"
+        self.assertFalse(self.router.allow_relation(room, resident))
+        resident._state.db = "shard_a"
+        self.assertTrue(self.router.allow_relation(room, resident))
+
+    def test_other_models_are_not_routed(self):
+        with on_shard("shard_a"):
+            self.assertIsNone(self.router.db_for_read(ChangeLogEntry))
+            self.assertIsNone(self.router.db_for_write(Job))
+            self.assertIsNone(self.router.db_for_read(User))
+
+    @override_settings(SHARD_DATABASES=[])
+    def test_inactive_without_shards(self):
+        with on_shard("shard_a"):
+            self.assertIsNone(self.router.db_for_read(Resident))
+            self.assertIsNone(self.router.db_for_write(Building))
+
+
+class PrimaryPinningMiddlewareTests(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        self.token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def test_write_sets_pin_cookie(self):
+        building_data = {"name": "New Building", "address": "456 New St"}
+        response = self.client.post("/api/buildings/", building_data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn("pin_primary", response.cookies)
+
+    def test_read_does_not_set_pin_cookie(self):
+        response = self.client.get("/api/buildings/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("pin_primary", response.cookies)
+
+    @override_settings(SHARD_DATABASES=[])
+    def test_reads_use_the_replica_until_the_client_writes(self):
+        building = Building.objects.create(name="Old Name", address="1 Test St")
+        url = f"/api/buildings/{building.id}/"
+        replica = connections["replica"]
+
+        with CaptureQueriesContext(replica) as unpinned:
+            self.client.get(url)
+        self.assertTrue(
+            any("resident_api_building" in q["sql"] for q in unpinned.captured_queries)
+        )
+
+        with CaptureQueriesContext(replica) as writing:
+            self.client.patch(url, {"name": "New Name"}, format="json")
+        with CaptureQueriesContext(replica) as pinned:
+            response = self.client.get(url)
+        self.assertEqual(response.data["name"], "New Name")
+        self.assertEqual(writing.captured_queries + pinned.captured_queries, [])
+
+        del self.client.cookies["pin_primary"]
+        with CaptureQueriesContext(replica) as expired:
+            self.client.get(url)
+        self.assertNotEqual(expired.captured_queries, [])
+
+    @override_settings(SHARD_DATABASES=[])
+    def test_batches_pin_only_once_a_sub_request_writes(self):
+        building = Building.objects.create(name="Old Name", address="1 Test St")
+        url = f"/api/buildings/{building.id}/"
+        replica = connections["replica"]
+
+        with CaptureQueriesContext(replica) as reads:
+            response = self.client.post(
+                "/api/batch/",
+                {"requests": [{"method": "GET", "path": url}]},
+                format="json",
+            )
+        self.assertEqual(response.data["responses"][0]["status"], 200)
+        self.assertNotEqual(reads.captured_queries, [])
+        self.assertNotIn("pin_primary", response.cookies)
+
+        batch = [
+            {"method": "PATCH", "path": url, "body": {"name": "New Name"}},
+            {"method": "GET", "path": url},
+        ]
+        with CaptureQueriesContext(replica) as writes:
+            response = self.client.post(
+                "/api/batch/", {"requests": batch}, format="json"
+            )
+        self.assertEqual(response.data["responses"][1]["body"]["name"], "New Name")
+        self.assertEqual(writes.captured_queries, [])
+        self.assertIn("pin_primary", response.cookies)
+
+
+class BatchRetrieveTests(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        self.token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        self.building = Building.objects.create(
+            name="Test Building", address="123 Test St"
+        )
+        self.rooms = [
+            Room.objects.create(building=self.building, room_number=str(n), capacity=2)
+            for n in range(1, 4)
+        ]
+
+    def test_id_in_returns_request_order(self):
+        ids = [self.rooms[2].id, self.rooms[0].id, self.rooms[1].id]
+        response = self.client.get(
+            "/api/rooms/", {"id__in": ",".join(str(pk) for pk in ids)}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([room["id"] for room in response.data], ids)
+
+    def test_id_in_skips_unknown_ids(self):
+        response = self.client.get(
+            "/api/rooms/", {"id__in": f"{self.rooms[1].id},999999"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([room["id"] for room in response.data], [self.rooms[1].id])
+
+    def test_id_in_rejects_non_integers(self):
+        response = self.client.get("/api/rooms/", {"id__in": "1,abc"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BatchViewTests(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        self.token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        self.building = Building.objects.create(
+            name="Test Building", address="123 Test St"
+        )
+        self.room = Room.objects.create(
+            building=self.building, room_number="101", capacity=2
+        )
+
+    def test_batch_runs_sub_requests(self):
+        batch = {
+            "requests": [
+                {"method": "GET", "path": f"/api/buildings/{self.building.id}/"},
+                {"method": "GET", "path": f"/api/rooms/?building={self.building.id}"},
+                {
+                    "method": "PATCH",
+                    "path": f"/api/rooms/{self.room.id}/",
+                    "body": {"capacity": 4},
+                },
+                {"method": "GET", "path": "/api/does-not-exist/"},
+            ]
+        }
+        response = self.client.post("/api/batch/", batch, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        responses = response.data["responses"]
+        self.assertEqual([sub["status"] for sub in responses], [200, 200, 200, 404])
+        self.assertEqual(responses[0]["body"]["name"], "Test Building")
+        self.assertEqual(responses[1]["body"]["count"], 1)
+        self.assertEqual(responses[2]["body"]["capacity"], 4)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.capacity, 4)
+
+    def test_batch_applies_sub_request_permissions(self):
+        non_admin_user = User.objects.create_user(
+            username="nonadminuser", password="nonadminpass"
+        )
+        non_admin_token = Token.objects.create(user=non_admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + non_admin_token.key)
+
+        batch = {"requests": [{"method": "GET", "path": "/api/rooms/"}]}
+        response = self.client.post("/api/batch/", batch, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["responses"][0]["status"], 403)
+
+    def test_batch_cannot_be_nested(self):
+        batch = {"requests": [{"method": "POST", "path": "/api/batch/"}]}
+        response = self.client.post("/api/batch/", batch, format="json")
+
+        self.assertEqual(response.data["responses"][0]["status"], 400)
+
+    def test_batch_only_runs_api_views(self):
+        batch = {
+            "requests": [
+                {"method": "GET", "path": "/admin/resident_api/resident/"},
+                {"method": "GET", "path": "/docs/"},
+                {"method": "GET", "path": "/api/rooms/"},
+            ]
+        }
+        response = self.client.post("/api/batch/", batch, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [sub["status"] for sub in response.data["responses"]], [400, 400, 200]
+        )
+
+    def test_batch_requires_authentication(self):
+        self.client.credentials()
+        batch = {"requests": [{"method": "GET", "path": "/api/rooms/"}]}
+        response = self.client.post("/api/batch/", batch, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class AdminTests(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        self.client.force_login(self.admin_user)
+
+        self.building = Building.objects.create(
+            name="Test Building", address="123 Test St"
+        )
+        for n in range(5):
+            room = Room.objects.create(
+                building=self.building, room_number=str(n), capacity=2
+            )
+            Resident.objects.create(
+                first_name="Jane",
+                last_name=f"Doe{n}",
+                email=f"jane{n}@example.com",
+                room=room,
+                check_in_date="2023-01-01",
+            )
+
+    def test_resident_changelist_query_count_is_flat(self):
+        with capture_queries() as small:
+            response = self.client.get("/admin/resident_api/resident/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        for n in range(5, 10):
+            room = Room.objects.create(
+                building=self.building, room_number=str(n), capacity=2
+            )
+            Resident.objects.create(
+                first_name="Jane",
+                last_name=f"Doe{n}",
+                email=f"jane{n}@example.com",
+                room=room,
+                check_in_date="2023-01-01",
+            )
+
+        with capture_queries() as large:
+            self.client.get("/admin/resident_api/resident/")
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+
+    def test_resident_change_form_uses_autocomplete(self):
+        resident = Resident.objects.first()
+        response = self.client.get(
+            f"/admin/resident_api/resident/{resident.id}/change/"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, "admin-autocomplete")
+        self.assertNotContains(response, 'name="room"><option')
+
+    def test_search_seeks_the_nocase_indexes(self):
+        for path, term, found in (
+            ("/admin/resident_api/resident/", "doe3", "jane3@example.com"),
+            ("/admin/resident_api/resident/", "JANE1@example.com", "Doe1"),
+            ("/admin/resident_api/room/", "test", "Test Building 4"),
+            ("/admin/resident_api/building/", "TEST", "Test Building"),
+        ):
+            response = self.client.get(path, {"q": term})
+            self.assertContains(response, found)
+            # The query for a page of a large result, i.e. with its LIMIT.
+            cl = response.context["cl"]
+            plan = cl.queryset[: cl.list_per_page].explain()
+            self.assertNotIn("SCAN", plan, msg=path)
+            self.assertIn("_nocase", plan, msg=path)
+
+    def test_estimated_count_paginator_small_table_counts_exactly(self):
+        paginator = EstimatedCountPaginator(Resident.objects.order_by("id"), 2)
+
+        self.assertEqual(paginator.count, 5)
+
+    @patch("resident_api.pagination.estimate_row_count", return_value=250000)
+    def test_estimated_count_paginator_uses_estimate(self, mock_estimate):
+        paginator = EstimatedCountPaginator(Resident.objects.order_by("id"), 100)
+
+        self.assertEqual(paginator.count, 250000)
+        self.assertEqual(paginator.num_pages, 2500)
+
+
+class LoggingPipelineTests(SimpleTestCase):
+    def make_record(self, level=logging.DEBUG, msg="query %s", args=("SELECT 1",)):
+        return logging.LogRecord(
+            "django.db.backends", level, __file__, 1, msg, args, None
+        )
+
+    def test_json_formatter(self):
+        entry = json.loads(JsonFormatter().format(self.make_record()))
+
+        self.assertEqual(entry["message"], "query SELECT 1")
+        self.assertEqual(entry["logger"], "django.db.backends")
+        self.assertEqual(entry["level"], "DEBUG")
+
+    def test_sampling_filter_rate_limits(self):
+        sampling = SamplingFilter(per_second=5)
+        passed = [sampling.filter(self.make_record()) for _ in range(20)]
+
+        self.assertLessEqual(passed.count(True), 10)
+        self.assertTrue(sampling.filter(self.make_record(level=logging.ERROR)))
+
+    def test_sampling_filter_rate(self):
+        sampling = SamplingFilter(rate=0.0)
+
+        self.assertFalse(sampling.filter(self.make_record()))
+        self.assertTrue(sampling.filter(self.make_record(level=logging.WARNING)))
+
+    def test_every_sql_logger_is_sampled(self):
+        for name in ("django.db.backends", "django.db.backends.schema"):
+            filters = logging.getLogger(name).filters
+            self.assertTrue(any(isinstance(f, SamplingFilter) for f in filters))
+
+    def test_background_handler_writes_off_thread(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "test.log")
+            handler = BackgroundRotatingFileHandler(filename, maxBytes=200)
+            handler.setFormatter(JsonFormatter())
+            for _ in range(10):
+                handler.handle(self.make_record())
+            handler.flush()
+            handler.close()
+
+            with open(filename) as log_file:
+                entry = json.loads(log_file.readline())
+            self.assertEqual(entry["message"], "query SELECT 1")
+            self.assertTrue(os.path.exists(filename + ".1"))
+
+
+class ChangeFeedTests(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        self.token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        self.building = Building.objects.create(
+            name="Test Building", address="123 Test St"
+        )
+        self.room = Room.objects.create(
+            building=self.building, room_number="101", capacity=2
+        )
+
+    def changes(self, since=0, **params):
+        response = self.client.get("/api/changes/", {"since": since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_records_create_update_delete(self):
+        since = self.changes()["next_since"]
+        response = self.client.patch(
+            f"/api/rooms/{self.room.id}/", {"capacity": 3}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.room.delete()
+
+        changes = self.changes(since)["changes"]
+        self.assertEqual(
+            [(c["model"], c["action"]) for c in changes],
+            [("room", "update"), ("room", "delete")],
+        )
+        self.assertIsNone(changes[-1]["data"])
+
+    def test_only_returns_changes_after_since(self):
+        data = self.changes()
+        self.assertEqual(
+            [(c["model"], c["action"]) for c in data["changes"]],
+            [("building", "create"), ("room", "create")],
+        )
+        self.assertEqual(data["changes"][1]["data"]["room_number"], "101")
+        self.assertEqual(self.changes(data["next_since"])["changes"], [])
+
+    def test_bulk_paths_are_recorded(self):
+        since = self.changes()["next_since"]
+        rooms = Room.objects.bulk_create(
+            [
+                Room(building=self.building, room_number=str(n), capacity=1)
+                for n in range(3)
+            ]
+        )
+        for room in rooms:
+            room.capacity = 4
+        Room.objects.bulk_update(rooms, ["capacity"])
+        Room.objects.filter(pk=self.room.pk).update(capacity=5)
+
+        actions = [c["action"] for c in self.changes(since)["changes"]]
+        self.assertEqual(actions, ["create"] * 3 + ["update"] * 4)
+
+    def test_limit_pages_through_changes(self):
+        data = self.changes(limit=1)
+        self.assertEqual(len(data["changes"]), 1)
+        self.assertTrue(data["has_more"])
+
+        data = self.changes(data["next_since"], limit=1)
+        self.assertEqual(data["changes"][0]["model"], "room")
+        self.assertFalse(data["has_more"])
+
+    def test_compaction_keeps_latest_entry_per_object(self):
+        for capacity in (3, 4, 5):
+            self.room.capacity = capacity
+            self.room.save()
+        ChangeLogEntry.objects.update(changed_at=timezone.now() - timedelta(days=30))
+
+        call_command("compact_changes", older_than=7, stdout=io.StringIO())
+
+        self.assertEqual(
+            list(ChangeLogEntry.objects.values_list("model", "action")),
+            [("building", "create"), ("room", "update")],
+        )
+
+    def test_untracked_models_keep_fast_delete(self):
+        collector = Collector(using="default")
+        self.assertTrue(collector.can_fast_delete(ChangeLogEntry.objects.all()))
+
+
+class WebhookReceiver(ThreadingHTTPServer):
+    """Local stand-in for a partner endpoint; records every delivery."""
+
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.deliveries = []
+        super().__init__(("127.0.0.1", 0), self.Handler)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            self.server.deliveries.append((dict(self.headers), body))
+            self.send_response(self.server.status_code)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/hook"
+
+
+class WebhookOutboxTests(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        self.token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        self.building = Building.objects.create(
+            name="Test Building", address="123 Test St"
+        )
+        self.room = Room.objects.create(
+            building=self.building, room_number="101", capacity=2
+        )
+        self.other_room = Room.objects.create(
+            building=self.building, room_number="102", capacity=2
+        )
+
+        self.receiver = WebhookReceiver()
+        threading.Thread(target=self.receiver.serve_forever, daemon=True).start()
+        self.addCleanup(self.receiver.server_close)
+        self.addCleanup(self.receiver.shutdown)
+        self.subscriber = WebhookSubscriber.objects.create(
+            name="Access control", url=self.receiver.url, secret="s3cret"
+        )
+
+    def create_resident(self):
+        resident_data = {
+            "first_name": "John",
+            "last_name": "Doe",
+            "email": "john.doe@example.com",
+            "room": self.room.id,
+            "check_in_date": "2023-01-01",
+        }
+        response = self.client.post("/api/residents/", resident_data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data["id"]
+
+    def test_resident_changes_write_outbox_events(self):
+        resident_id = self.create_resident()
+        self.client.patch(
+            f"/api/residents/{resident_id}/",
+            {"room": self.other_room.id, "check_out_date": "2023-06-30"},
+            format="json",
+        )
+        self.client.patch(
+            f"/api/residents/{resident_id}/", {"first_name": "Jon"}, format="json"
+        )
+
+        self.assertEqual(
+            list(OutboxEvent.objects.values_list("event_type", flat=True)),
+            [
+                OutboxEvent.CHECKED_IN,
+                OutboxEvent.ROOM_CHANGED,
+                OutboxEvent.CHECKED_OUT,
+            ],
+        )
+
+    def test_bulk_writes_and_room_deletion_write_outbox_events(self):
+        resident_id = self.create_resident()
+        other_room_id = self.other_room.id
+        residents = Resident.objects.filter(pk=resident_id)
+        residents.update(room=self.other_room)
+        resident = residents.get()
+        resident.check_out_date = date(2023, 6, 30)
+        Resident.objects.bulk_update([resident], ["check_out_date"])
+        self.other_room.delete()
+        Resident.objects.bulk_create(
+            [
+                Resident(
+                    first_name="Jane",
+                    last_name="Doe",
+                    email="jane.doe@example.com",
+                    room=self.room,
+                    check_in_date="2023-02-01",
+                )
+            ]
+        )
+
+        events = [
+            (e.event_type, e.payload["email"], e.payload["room"])
+            for e in OutboxEvent.objects.order_by("id")
+        ]
+        self.assertEqual(
+            events,
+            [
+                (OutboxEvent.CHECKED_IN, "john.doe@example.com", self.room.id),
+                (OutboxEvent.ROOM_CHANGED, "john.doe@example.com", other_room_id),
+                (OutboxEvent.CHECKED_OUT, "john.doe@example.com", other_room_id),
+                (OutboxEvent.ROOM_CHANGED, "john.doe@example.com", None),
+                (OutboxEvent.CHECKED_IN, "jane.doe@example.com", self.room.id),
+            ],
+        )
+
+    def test_worker_delivers_batch_and_advances_cursor(self):
+        self.create_resident()
+        Resident.objects.create(
+            first_name="Jane",
+            last_name="Doe",
+            email="jane.doe@example.com",
+            room=self.room,
+            check_in_date="2023-01-01",
+        )
+
+        self.assertEqual(deliver_pending(), 2)
+        self.assertEqual(deliver_pending(), 0)
+
+        self.assertEqual(len(self.receiver.deliveries), 1)
+        headers, body = self.receiver.deliveries[0]
+        events = json.loads(body)["events"]
+        self.assertEqual([e["type"] for e in events], [OutboxEvent.CHECKED_IN] * 2)
+        self.assertEqual(
+            headers["X-Webhook-Signature"], "sha256=" + sign("s3cret", body)
+        )
+        self.subscriber.refresh_from_db()
+        self.assertEqual(self.subscriber.cursor, events[-1]["id"])
+
+    def test_failed_delivery_backs_off_without_losing_events(self):
+        self.create_resident()
+        self.receiver.status_code = 503
+
+        self.assertEqual(deliver_pending(), 0)
+        self.subscriber.refresh_from_db()
+        self.assertEqual(self.subscriber.failures, 1)
+        self.assertEqual(self.subscriber.cursor, 0)
+        self.assertIsNotNone(self.subscriber.next_attempt_at)
+
+        # Not due yet, so the receiver is not contacted again.
+        self.receiver.status_code = 200
+        self.assertEqual(deliver_pending(), 0)
+        self.assertEqual(len(self.receiver.deliveries), 1)
+
+        WebhookSubscriber.objects.update(next_attempt_at=None)
+        self.assertEqual(deliver_pending(), 1)
+        self.subscriber.refresh_from_db()
+        self.assertEqual(self.subscriber.failures, 0)
+
+    def test_event_type_filter(self):
+        self.subscriber.event_types = OutboxEvent.CHECKED_OUT
+        self.subscriber.save()
+        self.create_resident()
+
+        self.assertEqual(deliver_pending(), 0)
+        self.assertEqual(self.receiver.deliveries, [])
+
+    def test_filtered_subscriber_does_not_hold_back_purge(self):
+        self.subscriber.event_types = OutboxEvent.CHECKED_OUT
+        self.subscriber.save()
+        resident_id = self.create_resident()
+        self.client.patch(
+            f"/api/residents/{resident_id}/",
+            {"room": self.other_room.id},
+            format="json",
+        )
+        head = OutboxEvent.objects.latest("id").id
+
+        self.assertEqual(deliver_pending(), 0)
+        self.subscriber.refresh_from_db()
+        self.assertEqual(self.subscriber.cursor, head)
+        self.assertEqual(purge_delivered(older_than=timedelta(0)), 2)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+        self.client.patch(
+            f"/api/residents/{resident_id}/",
+            {"check_out_date": "2023-06-30"},
+            format="json",
+        )
+        self.assertEqual(deliver_pending(), 1)
+        headers, body = self.receiver.deliveries[0]
+        self.assertEqual(
+            [event["type"] for event in json.loads(body)["events"]],
+            [OutboxEvent.CHECKED_OUT],
+        )
+
+
+class JobTests(APITestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+
+        self.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        self.token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        self.building = Building.objects.create(
+            name="Test Building", address="123 Test St"
+        )
+        self.room = Room.objects.create(
+            building=self.building, room_number="101", capacity=2
+        )
+        Resident.objects.create(
+            first_name="Jane",
+            last_name="Doe",
+            email="jane.doe@example.com",
+            room=self.room,
+            check_in_date="2023-01-01",
+        )
+
+    def run_queued_jobs(self):
+        for job_id in claim_jobs(10):
+            run_job(job_id)
+
+    def test_export_job_lifecycle(self):
+        response = self.client.post(
+            "/api/jobs/", {"kind": "export_residents"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_id = response.data["id"]
+        self.assertEqual(response.data["status"], Job.QUEUED)
+
+        self.run_queued_jobs()
+
+        response = self.client.get(f"/api/jobs/{job_id}/")
+        self.assertEqual(response.data["status"], Job.SUCCEEDED)
+        self.assertEqual(response.data["progress"], 100)
+
+        response = self.client.get(f"/api/jobs/{job_id}/result/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b"".join(response.streaming_content).decode()
+        self.assertIn("jane.doe@example.com", content)
+
+    def test_export_is_written_to_a_temporary_file(self):
+        filename, content, content_type = export_residents(None, lambda percent: None)
+        with content:
+            # A file on disk, not an in-memory buffer.
+            self.assertIsInstance(content.file.fileno(), int)
+            content.seek(0)
+            rows = list(csv.reader(content.read().decode().splitlines()))
+        self.assertEqual(rows[0], RESIDENT_COLUMNS)
+        self.assertEqual(rows[1][3], "jane.doe@example.com")
+
+    def test_import_job_reports_invalid_rows(self):
+        upload = SimpleUploadedFile(
+            "residents.csv",
+            (
+                "first_name,last_name,email,room_id,check_in_date,"
+                "building_id,room_number\n"
+                f"John,Doe,john.doe@example.com,{self.room.id},2023-01-01\n"
+                "Dup,Licate,jane.doe@example.com,,2023-01-01\n"
+                "No,Room,no.room@example.com,999999,2023-01-01\n"
+                f"By,Number,by.number@example.com,,2023-01-01,{self.building.id},101\n"
+                f"No,Number,no.number@example.com,,2023-01-01,{self.building.id},999\n"
+            ).encode(),
+            content_type="text/csv",
+        )
+        response = self.client.post(
+            "/api/jobs/",
+            {"kind": "import_residents", "input_file": upload},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        self.run_queued_jobs()
+
+        job = Job.objects.get(pk=response.data["id"])
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        summary = json.loads(job.result.read())
+        self.assertEqual(summary["created"], 2)
+        self.assertEqual([e["line"] for e in summary["errors"]], [3, 4, 6])
+        self.assertTrue(Resident.objects.filter(email="john.doe@example.com").exists())
+        self.assertEqual(
+            Resident.objects.get(email="by.number@example.com").room_id, self.room.id
+        )
+        self.assertEqual(
+            OutboxEvent.objects.filter(payload__email="john.doe@example.com").count(), 1
+        )
+
+    def test_abandoned_running_jobs_are_requeued(self):
+        job = Job.objects.create(kind="export_residents")
+        self.assertEqual(claim_jobs(1), [job.pk])
+        self.assertEqual(requeue_abandoned_jobs(), 0)
+
+        # The run_jobs process died without finishing or renewing the lease.
+        stale = timezone.now() - timedelta(minutes=5)
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=stale)
+        renew_leases([job.pk])
+        self.assertEqual(requeue_abandoned_jobs(), 0)
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=stale)
+        self.assertEqual(requeue_abandoned_jobs(), 1)
+
+        response = self.client.get(f"/api/jobs/{job.pk}/")
+        self.assertEqual(response.data["status"], Job.QUEUED)
+        self.run_queued_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+
+    def test_occupancy_report_job(self):
+        job = Job.objects.create(kind="occupancy_report")
+        self.run_queued_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertIn(b"Test Building,1,2,0.5000", job.result.read())
+
+    def test_failed_job_records_error(self):
+        job = Job.objects.create(kind="import_residents")
+        self.run_queued_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertTrue(job.error)
+        response = self.client.get(f"/api/jobs/{job.id}/result/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unknown_job_kind_is_rejected(self):
+        response = self.client.post("/api/jobs/", {"kind": "nope"}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class OccupancyReportTests(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        self.token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        self.building = Building.objects.create(
+            name="Test Building", address="123 Test St"
+        )
+        self.empty_building = Building.objects.create(
+            name="Empty Building", address="1 Empty St"
+        )
+        room = Room.objects.create(building=self.building, room_number="1", capacity=2)
+        Room.objects.create(building=self.building, room_number="2", capacity=2)
+        stays = [
+            ("2023-01-01", "2023-01-03"),
+            ("2023-01-02", None),
+            ("2022-12-01", "2022-12-31"),
+        ]
+        for n, (check_in, check_out) in enumerate(stays):
+            Resident.objects.create(
+                first_name="Jane",
+                last_name="Doe",
+                email=f"jane{n}@example.com",
+                room=room,
+                check_in_date=check_in,
+                check_out_date=check_out,
+            )
+
+    def test_daily_occupancy_kernel(self):
+        occupancy = daily_occupancy(
+            np.array([0, 0, 1]), np.array([0, 2, 1]), np.array([3, 5, 2]), 2, 5
+        )
+
+        self.assertEqual(occupancy.tolist(), [[1, 1, 2, 1, 1], [0, 1, 0, 0, 0]])
+
+    def test_daily_report(self):
+        response = self.client.get(
+            "/api/buildings/occupancy-report/",
+            {"from": "2023-01-01", "to": "2023-01-05"},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = [r for r in response.data if r["building"] == self.building.id]
+        self.assertEqual([r["occupants"] for r in rows], [1, 2, 2, 1, 1])
+        self.assertEqual(rows[1]["occupancy_rate"], 0.5)
+        self.assertEqual(rows[0]["capacity"], 4)
+        empty = [r for r in response.data if r["building"] == self.empty_building.id]
+        self.assertEqual([r["occupants"] for r in empty], [0] * 5)
+
+    def test_weekly_report(self):
+        response = self.client.get(
+            "/api/buildings/occupancy-report/",
+            {"from": "2023-01-01", "to": "2023-01-10", "granularity": "week"},
+        )
+
+        rows = [r for r in response.data if r["building"] == self.building.id]
+        self.assertEqual([str(r["date"]) for r in rows], ["2023-01-01", "2023-01-08"])
+        self.assertEqual(rows[0]["peak"], 2)
+        self.assertEqual(rows[0]["occupants"], round(9 / 7, 2))
+        self.assertEqual(rows[1]["occupants"], 1)
+
+    def test_csv_report(self):
+        response = self.client.get(
+            "/api/buildings/occupancy-report/",
+            {"from": "2023-01-01", "to": "2023-01-02", "format": "csv"},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        lines = response.content.decode().splitlines()
+        self.assertEqual(
+            lines[0],
+            "building,building_name,date,occupants,peak,capacity,occupancy_rate",
+        )
+        self.assertEqual(len(lines), 5)
+
+    def test_invalid_range(self):
+        response = self.client.get(
+            "/api/buildings/occupancy-report/",
+            {"from": "2023-02-01", "to": "2023-01-01"},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Well-formed but not a real date.
+        response = self.client.get(
+            "/api/buildings/occupancy-report/",
+            {"from": "2024-02-30", "to": "2024-03-05"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DailyOccupancyTests(APITestCase):
+    today = date(2023, 1, 10)
+
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        self.token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        self.building = Building.objects.create(
+            name="Test Building", address="123 Test St"
+        )
+        self.room = Room.objects.create(
+            building=self.building, room_number="1", capacity=2
+        )
+        self.other_room = Room.objects.create(
+            building=self.building, room_number="2", capacity=2
+        )
+        self.resident = Resident.objects.create(
+            first_name="Jane",
+            last_name="Doe",
+            email="jane@example.com",
+            room=self.room,
+            check_in_date="2023-01-01",
+            check_out_date="2023-01-05",
+        )
+        refresh_daily_occupancy(self.today)
+
+    def occupants(self, room):
+        return list(
+            DailyOccupancy.objects.filter(room=room)
+            .order_by("date")
+            .values_list("occupants", flat=True)
+        )
+
+    def test_initial_build(self):
+        self.assertEqual(self.occupants(self.room), [1] * 5 + [0] * 5)
+        self.assertEqual(self.occupants(self.other_room), [0] * 10)
+        self.assertFalse(OccupancyDirtyRange.objects.exists())
+
+    def test_refresh_only_touches_dirty_ranges(self):
+        resident = Resident.objects.get(pk=self.resident.pk)
+        resident.room = self.other_room
+        resident.check_out_date = date(2023, 1, 2)
+        resident.save()
+
+        with capture_queries() as ctx:
+            written = refresh_daily_occupancy(self.today)
+
+        # Old stay (Jan 1-5) and new stay (Jan 1-2) in two rooms, nothing else.
+        self.assertEqual(written, 7)
+        self.assertEqual(self.occupants(self.room), [0] * 10)
+        self.assertEqual(self.occupants(self.other_room), [1] * 2 + [0] * 8)
+        self.assertFalse(
+            any("resident_api_building" in q["sql"] for q in ctx.captured_queries)
+        )
+
+    def test_bulk_paths_mark_dirty(self):
+        Resident.objects.bulk_create(
+            [
+                Resident(
+                    first_name="Bulk",
+                    last_name="Resident",
+                    email="bulk@example.com",
+                    room=self.other_room,
+                    check_in_date=date(2023, 1, 9),
+                )
+            ]
+        )
+        Resident.objects.filter(pk=self.resident.pk).update(check_out_date=None)
+
+        refresh_daily_occupancy(self.today)
+
+        self.assertEqual(self.occupants(self.room), [1] * 10)
+        self.assertEqual(self.occupants(self.other_room), [0] * 8 + [1] * 2)
+
+    def test_interrupted_refresh_resumes_by_room_batch(self):
+        rebuild = reports._rebuild_rooms
+
+        def killed_at_other_room(intervals, using):
+            if self.other_room.pk in intervals:
+                raise RuntimeError("killed")
+            return rebuild(intervals, using)
+
+        with patch("resident_api.reports.REFRESH_ROOM_BATCH", 1), patch(
+            "resident_api.reports._rebuild_rooms", side_effect=killed_at_other_room
+        ), self.assertRaises(RuntimeError):
+            refresh_daily_occupancy(self.today, full=True)
+
+        # The first room's batch committed and consumed its dirty ranges.
+        self.assertEqual(self.occupants(self.room), [1] * 5 + [0] * 5)
+        self.assertEqual(self.occupants(self.other_room), [])
+        self.assertEqual(
+            set(OccupancyDirtyRange.objects.values_list("room_id", flat=True)),
+            {self.other_room.pk},
+        )
+
+        with patch("resident_api.reports.REFRESH_WRITE_BATCH", 3):
+            self.assertEqual(refresh_daily_occupancy(self.today), 10)
+        self.assertEqual(self.occupants(self.other_room), [0] * 10)
+        self.assertFalse(OccupancyDirtyRange.objects.exists())
+
+    def test_new_days_are_appended(self):
+        refresh_daily_occupancy(self.today + timedelta(days=2))
+
+        self.assertEqual(len(self.occupants(self.room)), 12)
+
+    def test_unchanged_stay_queues_nothing(self):
+        resident = Resident.objects.get(pk=self.resident.pk)
+        resident.first_name = "Janet"
+        resident.save()
+        events = OutboxEvent.objects.count()
+        Resident.objects.update(last_name="Smith")
+
+        self.assertFalse(OccupancyDirtyRange.objects.exists())
+        self.assertEqual(OutboxEvent.objects.count(), events)
+        self.assertEqual(Resident.objects.get(pk=resident.pk).last_name, "Smith")
+
+    def test_history_endpoint(self):
+        response = self.client.get(
+            "/api/buildings/occupancy-history/",
+            {"from": "2023-01-04", "to": "2023-01-06", "building": self.building.id},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["occupants"] for r in response.data], [1, 1, 0])
+        self.assertEqual(response.data[0]["capacity"], 4)
+        self.assertEqual(response.data[0]["occupancy_rate"], 0.25)
+
+
+class ResidentArchiveTests(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        self.token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        self.building = Building.objects.create(
+            name="Test Building", address="123 Test St"
+        )
+        self.room = Room.objects.create(
+            building=self.building, room_number="1", capacity=2
+        )
+        self.old = [
+            Resident.objects.create(
+                first_name="Old",
+                last_name=f"Resident{n}",
+                email=f"old{n}@example.com",
+                room=self.room,
+                check_in_date="2020-01-01",
+                check_out_date="2020-06-30",
+            )
+            for n in range(3)
+        ]
+        self.current = Resident.objects.create(
+            first_name="Jane",
+            last_name="Doe",
+            email="jane@example.com",
+            room=self.room,
+            check_in_date="2023-01-01",
+        )
+
+    def archive(self):
+        call_command("archive_residents", older_than_days=365, stdout=io.StringIO())
+
+    def test_archive_moves_checked_out_residents(self):
+        self.archive()
+        self.assertEqual(list(Resident.objects.all()), [self.current])
+        self.assertEqual(
+            sorted(ResidentArchive.objects.values_list("id", flat=True)),
+            [resident.id for resident in self.old],
+        )
+        archived = ResidentArchive.objects.get(pk=self.old[0].id)
+        self.assertEqual(archived.email, "old0@example.com")
+        self.assertEqual(archived.room, self.room)
+        deletes = ChangeLogEntry.objects.filter(
+            model="resident", action=ChangeLogEntry.DELETE
+        )
+        self.assertEqual(deletes.count(), 3)
+
+    def test_archive_runs_in_resumable_batches(self):
+        cutoff = date(2021, 1, 1)
+        self.assertEqual(archive_batch(cutoff, batch_size=2), 2)
+        self.assertEqual(Resident.objects.count(), 2)
+        self.assertEqual(archive_batch(cutoff, batch_size=2), 1)
+        self.assertEqual(archive_batch(cutoff, batch_size=2), 0)
+        self.assertEqual(ResidentArchive.objects.count(), 3)
+
+    def test_restore_skips_conflicting_email(self):
+        self.archive()
+        Resident.objects.create(
+            first_name="New",
+            last_name="Resident",
+            email="old1@example.com",
+            room=self.room,
+            check_in_date="2023-02-01",
+        )
+        events = OutboxEvent.objects.count()
+        stderr = io.StringIO()
+        call_command(
+            "restore_residents",
+            checked_out_after="2020-01-01",
+            stdout=io.StringIO(),
+            stderr=stderr,
+        )
+        self.assertTrue(Resident.objects.filter(pk=self.old[0].id).exists())
+        self.assertTrue(Resident.objects.filter(pk=self.old[2].id).exists())
+        self.assertEqual(
+            list(ResidentArchive.objects.values_list("id", flat=True)),
+            [self.old[1].id],
+        )
+        self.assertIn(str(self.old[1].id), stderr.getvalue())
+        # Restoring is not a check-in.
+        self.assertEqual(OutboxEvent.objects.count(), events)
+
+    def test_restore_skips_repeated_archived_email(self):
+        self.archive()
+        again = Resident.objects.create(
+            first_name="Old",
+            last_name="Resident0",
+            email="old0@example.com",
+            room=self.room,
+            check_in_date="2021-01-01",
+            check_out_date="2021-06-30",
+        )
+        self.archive()
+        stderr = io.StringIO()
+        call_command(
+            "restore_residents",
+            email=["old0@example.com"],
+            stdout=io.StringIO(),
+            stderr=stderr,
+        )
+        self.assertEqual(
+            list(Resident.objects.filter(email="old0@example.com")), [self.old[0]]
+        )
+        self.assertTrue(ResidentArchive.objects.filter(pk=again.pk).exists())
+        self.assertIn(str(again.pk), stderr.getvalue())
+
+    def test_list_excludes_archived_by_default(self):
+        self.archive()
+        response = self.client.get("/api/residents/")
+        self.assertEqual(
+            [row["id"] for row in response.data["results"]], [self.current.id]
+        )
+
+    def test_list_include_archived_merges_and_paginates(self):
+        self.archive()
+        ids = []
+        url = "/api/residents/?include_archived=true&page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [row["id"] for row in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(ids, sorted(r.id for r in [*self.old, self.current]))
+
+        response = self.client.get(
+            "/api/residents/",
+            {"include_archived": "true", "ordering": "-last_name"},
+        )
+        names = [row["last_name"] for row in response.data["results"]]
+        self.assertEqual(names, sorted(names, reverse=True))
+        archived = [row for row in response.data["results"] if "archived_at" in row]
+        self.assertEqual(len(archived), 3)
+
+    def test_retrieve_archived_resident(self):
+        self.archive()
+        url = f"/api/residents/{self.old[0].id}/"
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(url, {"include_archived": "true"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["email"], "old0@example.com")
+
+    def test_occupancy_report_counts_archived_stays(self):
+        self.archive()
+        response = self.client.get(
+            "/api/buildings/occupancy-report/",
+            {"from": "2020-03-01", "to": "2020-03-01"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]["occupants"], 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CoalescedCacheTests(APITransactionTestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        self.token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        self.building = Building.objects.create(
+            name="Test Building", address="123 Test St"
+        )
+        for n in range(3):
+            Room.objects.create(building=self.building, room_number=str(n), capacity=2)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_concurrent_identical_requests_compute_once(self):
+        clients = 8
+        barrier = threading.Barrier(clients)
+        lock = threading.Lock()
+        room_queries = []
+        responses = []
+
+        def slow_room_queries(execute, sql, params, many, context):
+            if 'FROM "resident_api_room"' in sql:
+                with lock:
+                    room_queries.append(sql)
+                time.sleep(0.2)
+            return execute(sql, params, many, context)
+
+        def fetch():
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+            try:
+                barrier.wait()
+                with wrap_all_connections(slow_room_queries):
+                    response = client.get("/api/rooms/")
+                with lock:
+                    responses.append(response)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=fetch) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([r.status_code for r in responses], [200] * clients)
+        self.assertEqual(len({json.dumps(r.data) for r in responses}), 1)
+        # One COUNT(*) and one page query, for all eight requests.
+        self.assertEqual(len(room_queries), 2)
+
+    def test_writes_invalidate_cached_responses(self):
+        self.assertEqual(self.client.get("/api/rooms/").data["count"], 3)
+        with capture_queries() as ctx:
+            self.client.get("/api/rooms/")
+        self.assertEqual(
+            [q for q in ctx.captured_queries if "resident_api_room" in q["sql"]], []
+        )
+
+        self.client.post(
+            "/api/rooms/",
+            {"building": self.building.id, "room_number": "9", "capacity": 1},
+            format="json",
+        )
+        self.assertEqual(self.client.get("/api/rooms/").data["count"], 4)
+
+        Room.objects.filter(room_number="9").update(capacity=3)
+        response = self.client.get("/api/rooms/", {"room_number": "9"})
+        self.assertEqual(response.data["results"][0]["capacity"], 3)
+
+    def test_stale_value_served_while_refreshing(self):
+        cache.set("key", {"value": "old", "fresh_until": 0}, 60)
+        cache.add("key:lock", True, 10)
+        calls = []
+        value = single_flight("key", lambda: calls.append(1) or "new", 60, 60)
+        self.assertEqual((value, calls), ("old", []))
+
+        cache.delete("key:lock")
+        self.assertEqual(single_flight("key", lambda: "new", 60, 60), "new")
+        self.assertEqual(single_flight("key", lambda: "newer", 60, 60), "new")
+
+    @override_settings(API_CACHE_WAIT_SECONDS=0.1)
+    def test_waiters_compute_after_timeout(self):
+        cache.add("key:lock", True, 10)
+        self.assertEqual(single_flight("key", lambda: "value", 60), "value")
+
+    def test_cache_outage_serves_uncached(self):
+        with patch("resident_api.caching.cache.get", side_effect=OSError("down")):
+            response = self.client.get(f"/api/buildings/{self.building.id}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["name"], "Test Building")
+
+    @patch("resident_api.caching._last_outage_warning", None)
+    def test_cache_outage_warns_once_per_interval(self):
+        with patch(
+            "resident_api.caching.cache.get", side_effect=OSError("down")
+        ), self.assertLogs("resident_api.caching", logging.DEBUG) as logs:
+            for _ in range(3):
+                self.client.get(f"/api/buildings/{self.building.id}/")
+        levels = [record.levelname for record in logs.records]
+        self.assertEqual(levels.count("WARNING"), 1)
+        self.assertGreater(levels.count("DEBUG"), 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ReferenceCacheTests(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username="adminuser", password="adminpass"
+        )
+        self.token = Token.objects.create(user=self.admin_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        self.building = Building.objects.create(
+            name="Test Building", address="123 Test St"
+        )
+        self.rooms = [
+            Room.objects.create(building=self.building, room_number=str(n), capacity=2)
+            for n in range(3)
+        ]
+
+    def tearDown(self):
+        cache.clear()
+
+    def post_resident(self, n, room):
+        return self.client.post(
+            "/api/residents/",
+            {
+                "first_name": "Jane",
+                "last_name": "Doe",
+                "email": f"jane{n}@example.com",
+                "room": room.id,
+                "check_in_date": "2023-01-01",
+            },
+            format="json",
+        )
+
+    def reference_queries(self, ctx):
+        return [
+            q["sql"]
+            for q in ctx.captured_queries
+            if 'FROM "resident_api_room"' in q["sql"]
+            or 'FROM "resident_api_building"' in q["sql"]
+        ]
+
+    def post_room(self, room_number):
+        return self.client.post(
+            "/api/rooms/",
+            {"building": self.building.id, "room_number": room_number, "capacity": 1},
+            format="json",
+        )
+
+    def test_warm_cache_validates_without_reference_queries(self):
+        self.post_room("8")
+        self.post_resident(0, self.rooms[0])
+        with capture_queries() as ctx:
+            resident = self.post_resident(1, self.rooms[0])
+            room = self.post_room("9")
+        self.assertEqual(resident.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resident.data["room"], self.rooms[0].id)
+        self.assertEqual(room.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.reference_queries(ctx), [])
+
+    def test_writes_invalidate_cached_rows(self):
+        room = self.rooms[1]
+        self.post_resident(0, room)
+        Room.objects.filter(pk=room.pk).delete()
+        response = self.post_resident(1, room)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("room", response.data)
+
+        Room.objects.filter(pk=self.rooms[2].pk).update(capacity=5)
+        self.assertEqual(reference_cache(Room).get(self.rooms[2].pk).capacity, 5)
+
+    def test_model_validation_uses_the_cache(self):
+        reference_cache(Room).get(self.rooms[0].pk)
+        resident = Resident(
+            first_name="Jane",
+            last_name="Doe",
+            email="jane@example.com",
+            room_id=self.rooms[0].pk,
+            check_in_date=date(2023, 1, 1),
+        )
+        with capture_queries() as ctx:
+            resident.full_clean()
+        self.assertEqual(self.reference_queries(ctx), [])
+
+        resident.room_id = 0
+        with self.assertRaises(ValidationError) as raised:
+            resident.full_clean()
+        self.assertIn("room", raised.exception.message_dict)
+
+    def test_rows_are_evicted_least_recently_used_first(self):
+        rooms = ReferenceCache(Room, maxsize=2)
+        for room in self.rooms:
+            rooms.get(room.pk)
+        with capture_queries() as ctx:
+            rooms.get(self.rooms[2].pk)
+            rooms.get(self.rooms[0].pk)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_natural_key_lookup(self):
+        rooms = reference_cache(Room)
+        self.assertEqual(
+            rooms.get_id(building_id=self.building.id, room_number="1"),
+            self.rooms[1].pk,
+        )
+        self.assertIsNone(rooms.get_id(building_id=self.building.id, room_number="x"))
+        Room.objects.create(building=self.building, room_number="x", capacity=1)
+        self.assertIsNotNone(
+            rooms.get_id(building_id=self.building.id, room_number="x")
+        )
+
+    def test_cache_outage_reads_the_database(self):
+        with patch("resident_api.caching.cache.get", side_effect=OSError("down")):
+            response = self.post_resident(0, self.rooms[0])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
 # class OAuth2IntegrationTests(APITestCase):
 #     def setUp(self):
 #         # Create a superuser (admin) for testing
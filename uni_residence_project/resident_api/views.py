@@ -1,10 +1,50 @@
-from rest_framework import viewsets
-from .models import Building, Room, Resident
-from .serializers import BuildingSerializer, RoomSerializer, ResidentSerializer
+import io
+import json
+from operator import itemgetter
+from urllib.parse import urlsplit
+
+from rest_framework import mixins, viewsets
+from rest_framework.decorators import action
+from .models import (
+    Building,
+    ChangeLogEntry,
+    Job,
+    Room,
+    Resident,
+    ResidentArchive,
+    ShardMap,
+)
+from .caching import coalesced_cache
+from .pagination import MergedQuerySet, ResidentCursorPagination
+from .renderers import CSVRenderer
+from .middleware import PIN_COOKIE_NAME, UNSAFE_METHODS
+from .routers import (
+    current_shard,
+    on_shard,
+    pin_to_primary,
+    reset_shard,
+    shards,
+    unpin,
+    use_shard,
+)
+from .reports import (
+    GRANULARITIES,
+    REPORT_MAX_DAYS,
+    occupancy_history,
+    occupancy_report,
+)
+from .serializers import (
+    BuildingSerializer,
+    JobSerializer,
+    RoomSerializer,
+    ResidentSerializer,
+)
 
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
 from oauth2_provider.contrib.rest_framework import OAuth2Authentication
@@ -13,9 +53,7 @@ from rest_framework.authentication import TokenAuthentication, SessionAuthentica
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
 
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
-from django.views.decorators.vary import vary_on_cookie
+from django.utils.dateparse import parse_date
 
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
@@ -28,17 +66,128 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+BATCH_RETRIEVE_MAX_IDS = 100
+
+
+class BatchRetrieveMixin:
+    """
+    Answer ``?id__in=3,1,2`` with a single query, returning the objects in the
+    order the ids were requested. Unknown ids are left out of the result.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if "id__in" not in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        try:
+            ids = [
+                int(value)
+                for value in request.query_params["id__in"].split(",")
+                if value.strip()
+            ]
+        except ValueError:
+            return Response(
+                {"id__in": ["Expected a comma separated list of integers."]},
+                status=400,
+            )
+        if len(ids) > BATCH_RETRIEVE_MAX_IDS:
+            return Response(
+                {"id__in": [f"At most {BATCH_RETRIEVE_MAX_IDS} ids are allowed."]},
+                status=400,
+            )
+
+        objects = self.filter_queryset(self.get_queryset()).in_bulk(ids)
+        instances = [objects[pk] for pk in dict.fromkeys(ids) if pk in objects]
+        serializer = self.get_serializer(instances, many=True)
+        return Response(serializer.data)
+
+
+class ShardedViewSetMixin:
+    """
+    Run each request on the shard holding its building, found through
+    ShardMap from the object id, or else from the first ``shard_fields``
+    value in the query string or request body. Lists that name no building
+    fan out to every shard and are merged in the requested order.
+    """
+
+    shard_fields = ("building", "room")
+
+    def request_shard(self):
+        pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        sources = [self.request.query_params]
+        if isinstance(self.request.data, dict):
+            sources.append(self.request.data)
+        if pk is None:
+            values = (s.get(field) for s in sources for field in self.shard_fields)
+            pk = next((value for value in values if value), None)
+        if pk is None or not str(pk).isdigit():
+            return None
+        return ShardMap.shard_of(pk)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if ShardMap.shards():
+            self.shard_token = use_shard(self.request_shard())
+
+    def dispatch(self, request, *args, **kwargs):
+        self.shard_token = None
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self.shard_token is not None:
+                reset_shard(self.shard_token)
+
+    def filter_queryset(self, queryset):
+        if self.action != "list" or current_shard() or not ShardMap.shards():
+            return super().filter_queryset(queryset)
+        filtered = []
+        for alias in ShardMap.shards():
+            with on_shard(alias):
+                filtered.append(super().filter_queryset(queryset.using(alias)))
+        return MergedQuerySet(filtered)
+
+
+def on_each_shard(report, *args):
+    """Run a report on every shard and combine its rows by building and date."""
+    rows = []
+    for alias in shards():
+        with on_shard(alias):
+            rows += report(*args)
+    return sorted(rows, key=itemgetter("building", "date"))
+
+
 def custom_exception_handler(exc, context):
     response = exception_handler(exc, context)
 
     if response is not None:
         response.data["status_code"] = response.status_code
-        logger.error(f"Error: {exc}, Status Code: {response.status_code}")
+        logger.error("Error: %s, Status Code: %s", exc, response.status_code)
 
     return response
 
 
-class BuildingViewSet(viewsets.ModelViewSet):
+def report_range(request):
+    """Parse the ``from``/``to`` query parameters shared by the reports."""
+    try:
+        date_from = parse_date(request.query_params.get("from", ""))
+        date_to = parse_date(request.query_params.get("to", ""))
+    except ValueError:
+        date_from = date_to = None
+    if date_from is None or date_to is None or date_from > date_to:
+        error = Response(
+            {"error": "from and to must be dates (YYYY-MM-DD) with from <= to"},
+            status=400,
+        )
+        return None, None, error
+    if (date_to - date_from).days >= REPORT_MAX_DAYS:
+        error = Response(
+            {"error": f"Reports cover at most {REPORT_MAX_DAYS} days"}, status=400
+        )
+        return None, None, error
+    return date_from, date_to, None
+
+
+class BuildingViewSet(ShardedViewSetMixin, BatchRetrieveMixin, viewsets.ModelViewSet):
     queryset = Building.objects.all()
     serializer_class = BuildingSerializer
     authentication_classes = [
@@ -58,11 +207,89 @@ class BuildingViewSet(viewsets.ModelViewSet):
     filterset_fields = ["name", "address"]
     search_fields = ["name", "address"]
     ordering_fields = ["name"]
+    shard_fields = ()
 
-    @method_decorator(cache_page(60 * 15))  # Cache for 15 minutes
-    @method_decorator(vary_on_cookie)
-    def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                "from",
+                openapi.IN_QUERY,
+                description="First day of the report",
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_DATE,
+                required=True,
+            ),
+            openapi.Parameter(
+                "to",
+                openapi.IN_QUERY,
+                description="Last day of the report",
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_DATE,
+                required=True,
+            ),
+            openapi.Parameter(
+                "granularity",
+                openapi.IN_QUERY,
+                description="day or week",
+                type=openapi.TYPE_STRING,
+            ),
+        ]
+    )
+    @action(
+        detail=False,
+        url_path="occupancy-report",
+        renderer_classes=[JSONRenderer, BrowsableAPIRenderer, CSVRenderer],
+    )
+    def occupancy_report(self, request):
+        date_from, date_to, error = report_range(request)
+        if error:
+            return error
+        granularity = request.query_params.get("granularity", "day")
+        if granularity not in GRANULARITIES:
+            return Response({"error": "granularity must be day or week"}, status=400)
+        return Response(
+            on_each_shard(occupancy_report, date_from, date_to, granularity)
+        )
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                "from",
+                openapi.IN_QUERY,
+                description="First day of the history",
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_DATE,
+                required=True,
+            ),
+            openapi.Parameter(
+                "to",
+                openapi.IN_QUERY,
+                description="Last day of the history",
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_DATE,
+                required=True,
+            ),
+            openapi.Parameter(
+                "building",
+                openapi.IN_QUERY,
+                description="Restrict to one building ID",
+                type=openapi.TYPE_INTEGER,
+            ),
+        ]
+    )
+    @action(
+        detail=False,
+        url_path="occupancy-history",
+        renderer_classes=[JSONRenderer, BrowsableAPIRenderer, CSVRenderer],
+    )
+    def occupancy_history(self, request):
+        date_from, date_to, error = report_range(request)
+        if error:
+            return error
+        building = request.query_params.get("building")
+        if building is not None and not building.isdigit():
+            return Response({"error": "building must be an integer"}, status=400)
+        return Response(on_each_shard(occupancy_history, date_from, date_to, building))
 
     @swagger_auto_schema(
         manual_parameters=[
@@ -83,15 +310,20 @@ class BuildingViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
+    @coalesced_cache
     def list(self, request, *args, **kwargs):
         try:
             return super().list(request, *args, **kwargs)
         except Exception as e:
-            logger.error(f"Error in BuildingViewSet.list: {str(e)}")
+            logger.error("Error in BuildingViewSet.list: %s", e)
             return Response({"error": "An unexpected error occurred"}, status=500)
 
+    @coalesced_cache
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
-class RoomViewSet(viewsets.ModelViewSet):
+class RoomViewSet(ShardedViewSetMixin, BatchRetrieveMixin, viewsets.ModelViewSet):
     queryset = Room.objects.all()
     serializer_class = RoomSerializer
     authentication_classes = [
@@ -111,11 +343,7 @@ class RoomViewSet(viewsets.ModelViewSet):
     filterset_fields = ["building", "room_number", "capacity"]
     search_fields = ["room_number"]
     ordering_fields = ["capacity"]
-
-    @method_decorator(cache_page(60 * 15))
-    @method_decorator(vary_on_cookie)
-    def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+    shard_fields = ("building",)
 
     @swagger_auto_schema(
         manual_parameters=[
@@ -136,17 +364,23 @@ class RoomViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
+    @coalesced_cache
     def list(self, request, *args, **kwargs):
         try:
             return super().list(request, *args, **kwargs)
         except Exception as e:
-            logger.error(f"Error in BuildingViewSet.list: {str(e)}")
+            logger.error("Error in RoomViewSet.list: %s", e)
             return Response({"error": "An unexpected error occurred"}, status=500)
 
+    @coalesced_cache
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
-class ResidentViewSet(viewsets.ModelViewSet):
+class ResidentViewSet(ShardedViewSetMixin, BatchRetrieveMixin, viewsets.ModelViewSet):
     queryset = Resident.objects.all()
     serializer_class = ResidentSerializer
+    pagination_class = ResidentCursorPagination
     authentication_classes = [
         OAuth2Authentication,
         TokenAuthentication,
@@ -161,9 +395,34 @@ class ResidentViewSet(viewsets.ModelViewSet):
         filters.SearchFilter,
         filters.OrderingFilter,
     ]
-    filterset_fields = ["room", "check_in_date", "check_out_date"]
+    filterset_fields = ["room", "room__building", "check_in_date", "check_out_date"]
     search_fields = ["first_name", "last_name", "email"]
     ordering_fields = ["last_name", "check_in_date"]
+    shard_fields = ("room__building", "room")
+
+    def include_archived(self):
+        return self.request.query_params.get("include_archived") == "true"
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if (
+            self.action == "list"
+            and self.include_archived()
+            and "id__in" not in self.request.query_params
+        ):
+            archived = super().filter_queryset(ResidentArchive.objects.all())
+            queryset = MergedQuerySet([queryset, archived])
+        return queryset
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != "retrieve" or not self.include_archived():
+                raise
+        resident = get_object_or_404(ResidentArchive, pk=self.kwargs["pk"])
+        self.check_object_permissions(self.request, resident)
+        return resident
 
     @swagger_auto_schema(
         manual_parameters=[
@@ -189,17 +448,138 @@ class ResidentViewSet(viewsets.ModelViewSet):
         try:
             return super().list(request, *args, **kwargs)
         except Exception as e:
-            logger.error(f"Error in BuildingViewSet.list: {str(e)}")
+            logger.error("Error in ResidentViewSet.list: %s", e)
             return Response({"error": "An unexpected error occurred"}, status=500)
 
 
-from django.http import HttpResponse
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import FileResponse, Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import Resolver404, resolve
 
 
 def home(request):
     return HttpResponse("Welcome to the Uni Residence Management API")
 
 
+CHANGE_FEED_DEFAULT_LIMIT = 500
+CHANGE_FEED_MAX_LIMIT = 5000
+CHANGE_FEED_SERIALIZERS = {
+    "building": (Building, BuildingSerializer),
+    "room": (Room, RoomSerializer),
+    "resident": (Resident, ResidentSerializer),
+}
+
+
+# This class serves the incremental change feed used by downstream syncs.
+class ChangeFeedView(APIView):
+    """
+    Return changes with a sequence number greater than ``since``, oldest
+    first, with the current state of each changed object (``null`` once it has
+    been deleted). Clients store ``next_since`` and pass it back on the next
+    sync; while ``has_more`` is true there are further pages to fetch.
+    """
+
+    authentication_classes = [
+        OAuth2Authentication,
+        TokenAuthentication,
+        SessionAuthentication,
+    ]
+    permission_classes = [
+        IsAuthenticated,
+        IsAdminUser,
+    ]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.query_params.get("since", 0))
+            limit = int(request.query_params.get("limit", CHANGE_FEED_DEFAULT_LIMIT))
+        except ValueError:
+            return Response({"error": "since and limit must be integers"}, status=400)
+        limit = max(1, min(limit, CHANGE_FEED_MAX_LIMIT))
+
+        entries = list(
+            ChangeLogEntry.objects.filter(seq__gt=since).order_by("seq")[: limit + 1]
+        )
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+
+        data = {}
+        for model_name, (model, serializer_class) in CHANGE_FEED_SERIALIZERS.items():
+            ids = {e.object_id for e in entries if e.model == model_name}
+            data[model_name] = {}
+            for alias in shards() if ids else ():
+                with on_shard(alias):
+                    objects = model.objects.in_bulk(ids)
+                data[model_name].update(
+                    (pk, serializer_class(obj, context={"request": request}).data)
+                    for pk, obj in objects.items()
+                )
+
+        changes = [
+            {
+                "seq": entry.seq,
+                "model": entry.model,
+                "id": entry.object_id,
+                "action": entry.action,
+                "changed_at": entry.changed_at,
+                "data": data.get(entry.model, {}).get(entry.object_id),
+            }
+            for entry in entries
+        ]
+        return Response(
+            {
+                "changes": changes,
+                "next_since": entries[-1].seq if entries else since,
+                "has_more": has_more,
+            }
+        )
+
+
+class JobViewSet(
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.ListModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Queue long-running work (exports, imports, reports) for the ``run_jobs``
+    worker and poll its status. Creating a job returns 202 immediately.
+    """
+
+    queryset = Job.objects.order_by("-id")
+    serializer_class = JobSerializer
+    authentication_classes = [
+        OAuth2Authentication,
+        TokenAuthentication,
+        SessionAuthentication,
+    ]
+    permission_classes = [
+        IsAuthenticated,
+        IsAdminUser,
+    ]
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.status_code = 202
+        return response
+
+    def perform_create(self, serializer):
+        serializer.save(created_by=self.request.user)
+
+    @action(detail=True)
+    def result(self, request, pk=None):
+        job = self.get_object()
+        if job.status != Job.SUCCEEDED or not job.result:
+            return Response({"error": "The job has no result yet"}, status=404)
+        return FileResponse(
+            job.result.open("rb"),
+            as_attachment=True,
+            filename=job.result.name.rsplit("/", 1)[-1],
+            content_type=job.result_content_type or None,
+        )
+
+
 # This class handles custom authentication token generation.
 class CustomAuthToken(ObtainAuthToken):
     def post(self, request, *args, **kwargs):
@@ -210,3 +590,128 @@ class CustomAuthToken(ObtainAuthToken):
         user = serializer.validated_data["user"]
         token, created = Token.objects.get_or_create(user=user)
         return Response({"token": token.key, "user_id": user.pk, "email": user.email})
+
+
+BATCH_MAX_REQUESTS = 20
+
+
+# This class runs several API calls in-process under one authentication pass.
+class BatchView(APIView):
+    """
+    Execute a list of sub-requests and return all their responses together::
+
+        {"requests": [{"method": "GET", "path": "/api/rooms/?building=1"},
+                      {"method": "PATCH", "path": "/api/residents/3/",
+                       "body": {"room": 2}}]}
+
+    The caller is authenticated once for the whole batch; each sub-request is
+    dispatched straight to its view (skipping middleware and
+    re-authentication) and still goes through that view's permission checks.
+    """
+
+    authentication_classes = [
+        OAuth2Authentication,
+        TokenAuthentication,
+        SessionAuthentication,
+    ]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        specs = request.data.get("requests") if isinstance(request.data, dict) else None
+        if not isinstance(specs, list) or not specs:
+            return Response(
+                {"requests": ["Expected a non-empty list of sub-requests."]},
+                status=400,
+            )
+        if len(specs) > BATCH_MAX_REQUESTS:
+            return Response(
+                {
+                    "requests": [
+                        f"At most {BATCH_MAX_REQUESTS} sub-requests are allowed."
+                    ]
+                },
+                status=400,
+            )
+        # The batch is always a POST, but only sub-requests that write pin the
+        # client to the primary (see PrimaryPinningMiddleware).
+        self.wrote = False
+        token = pin_to_primary(PIN_COOKIE_NAME in request.COOKIES)
+        try:
+            responses = [self._execute(request, spec) for spec in specs]
+        finally:
+            unpin(token)
+        request._request.wrote_to_primary = self.wrote
+        return Response({"responses": responses})
+
+    def _execute(self, request, spec):
+        if not isinstance(spec, dict) or not isinstance(spec.get("path"), str):
+            return {"status": 400, "body": {"path": ["This field is required."]}}
+
+        url = urlsplit(spec["path"])
+        if not url.path.startswith("/api/"):
+            return {"status": 400, "body": {"detail": "Only API paths can be batched."}}
+        try:
+            match = resolve(url.path)
+        except Resolver404:
+            return {"status": 404, "body": {"detail": "Not found."}}
+        view_class = getattr(match.func, "cls", None)
+        if not (isinstance(view_class, type) and issubclass(view_class, APIView)):
+            return {"status": 400, "body": {"detail": "Only API paths can be batched."}}
+        if view_class is BatchView:
+            return {"status": 400, "body": {"detail": "Batches cannot be nested."}}
+
+        sub_request = self._build_sub_request(request, spec, url)
+        sub_request.resolver_match = match
+        writes = sub_request.method in UNSAFE_METHODS
+        if writes:
+            # Later sub-requests in the batch read their own writes.
+            pin_to_primary()
+        try:
+            response = match.func(sub_request, *match.args, **match.kwargs)
+            if hasattr(response, "data"):
+                body = response.data
+            else:
+                content = response.content.decode(response.charset)
+                if response.get("Content-Type", "").startswith("application/json"):
+                    body = json.loads(content or "null")
+                else:
+                    body = content
+        except Exception:
+            logger.exception(
+                "Error in batch sub-request %s %s", spec.get("method"), url.path
+            )
+            return {"status": 500, "body": {"error": "An unexpected error occurred"}}
+        if writes and response.status_code < 400:
+            self.wrote = True
+        return {"status": response.status_code, "body": body}
+
+    def _build_sub_request(self, request, spec, url):
+        payload = b""
+        if spec.get("body") is not None:
+            payload = json.dumps(spec["body"]).encode()
+
+        environ = {
+            key: value
+            for key, value in request.META.items()
+            if key.startswith("HTTP_")
+            or key in ("SERVER_NAME", "SERVER_PORT", "REMOTE_ADDR")
+        }
+        environ.update(
+            {
+                "REQUEST_METHOD": str(spec.get("method", "GET")).upper(),
+                "PATH_INFO": url.path,
+                "SCRIPT_NAME": "",
+                "QUERY_STRING": url.query,
+                "CONTENT_TYPE": "application/json",
+                "CONTENT_LENGTH": str(len(payload)),
+                "wsgi.input": io.BytesIO(payload),
+                "wsgi.url_scheme": request.scheme,
+            }
+        )
+        sub_request = WSGIRequest(environ)
+
+        # Reuse the batch's authentication instead of running it again.
+        sub_request.user = request.user
+        sub_request._force_auth_user = request.user
+        sub_request._force_auth_token = request.auth
+        return sub_request
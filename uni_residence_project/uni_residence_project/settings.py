@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
+import sys
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -53,6 +55,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "resident_api.middleware.PrimaryPinningMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -81,13 +84,89 @@ WSGI_APPLICATION = "uni_residence_project.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+SQLITE_OPTIONS = {
+    "timeout": 20,
+    "transaction_mode": "IMMEDIATE",
+    "init_command": (
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA cache_size=-20000;"
+        "PRAGMA temp_store=MEMORY;"
+        "PRAGMA mmap_size=134217728;"
+    ),
+}
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "CONN_MAX_AGE": 60,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": SQLITE_OPTIONS,
     }
 }
 
+TESTING = sys.argv[1:2] == ["test"]
+
+# Point REPLICA_DB_NAME at a second SQLite file (or set up a real replica) to
+# serve resident_api reads from it. Writes always go to "default". Tests always
+# run with a replica, mirrored onto the test database.
+REPLICA_DB_NAME = os.environ.get("REPLICA_DB_NAME") or (
+    "replica.sqlite3" if TESTING else None
+)
+if REPLICA_DB_NAME:
+    DATABASES["replica"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / REPLICA_DB_NAME,
+        "CONN_MAX_AGE": 60,
+        "CONN_HEALTH_CHECKS": True,
+        # Only ever read: no write lock on BEGIN. read_uncommitted lets the
+        # test mirror (a shared-cache in-memory database) see rows the
+        # primary's test transaction has not committed; it has no effect on
+        # a file database.
+        "OPTIONS": {
+            **SQLITE_OPTIONS,
+            "transaction_mode": "DEFERRED",
+            "init_command": SQLITE_OPTIONS["init_command"]
+            + "PRAGMA query_only=1;PRAGMA read_uncommitted=1;",
+        },
+        "TEST": {"MIRROR": "default"},
+    }
+
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != "default"]
+
+# Set SHARD_DB_NAMES to a comma separated list of SQLite files to spread the
+# buildings, with their rooms and residents, across several databases. The
+# ShardMap directory and everything else stays on "default". Tests always get
+# two throwaway shard databases but leave sharding off; the sharding tests turn
+# it on for themselves.
+SHARD_DB_NAMES = [
+    name for name in os.environ.get("SHARD_DB_NAMES", "").split(",") if name
+]
+if TESTING and not SHARD_DB_NAMES:
+    SHARD_DB_NAMES = [
+        os.path.join(tempfile.gettempdir(), f"residence_shard_{n}.sqlite3")
+        for n in range(2)
+    ]
+for n, name in enumerate(SHARD_DB_NAMES):
+    DATABASES[f"shard_{n}"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / name,
+        "CONN_MAX_AGE": 60,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": SQLITE_OPTIONS,
+    }
+
+SHARD_DATABASES = [] if TESTING else [f"shard_{n}" for n in range(len(SHARD_DB_NAMES))]
+
+# How long a client keeps reading from the primary after a write.
+REPLICA_PIN_SECONDS = 5
+
+DATABASE_ROUTERS = [
+    "resident_api.routers.ShardRouter",
+    "resident_api.routers.PrimaryReplicaRouter",
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -125,6 +204,9 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Uploaded job inputs and generated job results.
+MEDIA_ROOT = BASE_DIR / "media"
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -154,31 +236,77 @@ CACHES = {
     }
 }
 
+# Building and room GET responses are cached, and on a miss only one request
+# per cache key recomputes them while identical requests wait for its result
+# (resident_api.caching). Writes to a model invalidate its cached responses.
+API_CACHE_SECONDS = 60 * 15
+# Keep serving an expired response this much longer while it is refreshed.
+API_CACHE_STALE_SECONDS = 60
+# How long a recomputation may hold the lock, and others wait for it.
+API_CACHE_LOCK_SECONDS = 10
+API_CACHE_WAIT_SECONDS = 5
+
+# A running job whose run_jobs process has not renewed its lease for this
+# long (the process was killed or restarted) is put back in the queue.
+JOB_LEASE_SECONDS = 60
+
+# Each process also keeps up to this many building and room rows in memory so
+# that validating a write needs no lookups of them; they are dropped whenever
+# the model's cache version moves.
+REFERENCE_CACHE_SIZE = 10000
+
+# Records are handed to a queue and written by a background thread, so the
+# request path never waits on disk. SQL debug logging is sampled.
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
     "formatters": {
-        "verbose": {
-            "format": "{levelname} {asctime} {module} {process:d} {thread:d} {message}",
-            "style": "{",
+        "json": {
+            "()": "resident_api.log.JsonFormatter",
+        },
+    },
+    "filters": {
+        "sample_sql": {
+            "()": "resident_api.log.SamplingFilter",
+            "rate": 0.1,
+            "per_second": 50,
         },
     },
     "handlers": {
         "file": {
+            "()": "resident_api.log.BackgroundRotatingFileHandler",
             "level": "DEBUG",
-            "class": "logging.FileHandler",
             "filename": os.path.join(BASE_DIR, "debug.log"),
-            "formatter": "verbose",
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 5,
+            "formatter": "json",
         },
     },
     "loggers": {
         "django": {
             "handlers": ["file"],
-            "level": "DEBUG",
+            "level": "INFO",
             "propagate": True,
         },
+        "django.db.backends": {
+            "level": "DEBUG",
+            "filters": ["sample_sql"],
+        },
+        # Logger filters do not see records propagated from child loggers.
+        "django.db.backends.schema": {
+            "level": "DEBUG",
+            "filters": ["sample_sql"],
+        },
+        "resident_api": {
+            "handlers": ["file"],
+            "level": "INFO",
+        },
     },
 }
 
+# Residents checked out longer ago than this are moved to ResidentArchive by
+# the archive_residents command.
+RESIDENT_ARCHIVE_AFTER_DAYS = 365
+
 # OAuth2 settings
 OAUTH2_PROVIDER = {"SCOPES": {"read": "Read scope", "write": "Write scope"}}
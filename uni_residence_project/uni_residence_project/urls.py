@@ -2,8 +2,11 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from resident_api.views import (
+    BatchView,
     BuildingViewSet,
+    ChangeFeedView,
     CustomAuthToken,
+    JobViewSet,
     RoomViewSet,
     ResidentViewSet,
 )
@@ -26,10 +29,13 @@ router = DefaultRouter()
 router.register(r"buildings", BuildingViewSet)
 router.register(r"rooms", RoomViewSet)
 router.register(r"residents", ResidentViewSet)
+router.register(r"jobs", JobViewSet)
 
 urlpatterns = [
     path("", home, name="home"),
     path("admin/", admin.site.urls),
+    path("api/batch/", BatchView.as_view(), name="batch"),
+    path("api/changes/", ChangeFeedView.as_view(), name="changes"),
     path("api/", include(router.urls)),
     path(
         "docs/",